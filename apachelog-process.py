@@ -6,22 +6,44 @@ Use the options to build a parser and list of processors.  Each file
 listed on the command line will be parsed by this parser and processed
 by each processor.  After processing is complete, interesting
 information from each processor will be printed to stdout.
+
+With ``--state``, the processors and the position reached in each
+file are saved after the run, and the next run with the same state
+file only processes the lines added since.
+
+With ``--follow``, a single growing log is followed instead, and the
+output is printed (or written to the ``--snapshot`` file) every
+``--interval`` seconds.
 """
 
+import copy as _copy
+import datetime as _datetime
+import os as _os
 import socket as _socket
+import time as _time
 
 from apachelog import __version__
+from apachelog.date import epoch_time as _epoch_time
+from apachelog.file import follow as _follow
 from apachelog.file import open as _open
+from apachelog.parallel import process_files as _process_files
 from apachelog.parser import FORMATS as _FORMATS
 from apachelog.parser import Parser as _Parser
 from apachelog.processor import process as _process
+from apachelog.processor import required_fields as _required_fields
 from apachelog.processor.bandwidth import (
     BandwidthProcessor as _BandwidthProcessor)
 from apachelog.processor.bandwidth import (
     IPBandwidthProcessor as _IPBandwidthProcessor)
 from apachelog.processor.set import SetProcessor as _SetProcessor
 from apachelog.processor.status import StatusProcessor as _StatusProcessor
+from apachelog.processor.status import (
+    StatusCountProcessor as _StatusCountProcessor)
+from apachelog.processor.timeseries import (
+    TimeSeriesProcessor as _TimeSeriesProcessor)
 from apachelog.resolve import Resolver as _Resolver
+from apachelog.resolve import SQLiteCache as _SQLiteCache
+from apachelog.state import State as _State
 
 
 PROCESSORS = {
@@ -29,6 +51,8 @@ PROCESSORS = {
     'ip-bandwidth': _IPBandwidthProcessor,
     'set': _SetProcessor,
     'status': _StatusProcessor,
+    'status-count': _StatusCountProcessor,
+    'time-series': _TimeSeriesProcessor,
     }
 
 
@@ -39,6 +63,60 @@ def display_processor(processor, **kwargs):
             display = globals()['display_{}'.format(pname)]
             return display(processor=processor, **kwargs)
 
+def display_processors(stream, processors, **kwargs):
+    for processor in processors:
+        display_processor(stream=stream, processor=processor, **kwargs)
+        if processor != processors[-1]:
+            stream.write('\n')  # blank line between output blocks
+
+def write_snapshot(path, processors, header='', **kwargs):
+    "Replace ``path`` with the current output, atomically."
+    tmp = '{}.tmp'.format(path)
+    with open(tmp, 'w') as stream:
+        stream.write(header)
+        display_processors(stream=stream, processors=processors, **kwargs)
+    _os.rename(tmp, path)
+
+def follow(filename, parser, processors, args, **kwargs):
+    """Process a growing log, displaying snapshots every ``args.interval``
+
+    Unparsable lines (e.g. a partial first line with ``--from-end``)
+    are skipped and counted in the snapshots.
+    """
+    bad_lines = []
+    skipped = [0]
+
+    def snapshot():
+        header = '# Skipped {} unparsable lines\n'.format(skipped[0])
+        if args.snapshot:
+            write_snapshot(
+                path=args.snapshot, processors=processors, header=header,
+                args=args, **kwargs)
+        else:
+            sys.stdout.write('# Snapshot {}\n'.format(
+                    _datetime.datetime.now().isoformat()))
+            sys.stdout.write(header)
+            display_processors(
+                stream=sys.stdout, processors=processors, args=args,
+                **kwargs)
+            sys.stdout.write('\n')
+            sys.stdout.flush()
+
+    next_snapshot = _time.time() + args.interval
+    try:
+        for lines in _follow(filename, from_end=args.from_end):
+            if lines:
+                _process(stream=lines, parser=parser, processors=processors,
+                         errors='collect', bad_lines=bad_lines)
+                skipped[0] += len(bad_lines)
+                del bad_lines[:]
+            if _time.time() >= next_snapshot:
+                snapshot()
+                next_snapshot = _time.time() + args.interval
+    except KeyboardInterrupt:
+        pass
+    snapshot()
+
 def display_bandwidth(stream, processor, args, **kwargs):
     scale = args.scale
     stream.write('# IP bandwidth ({})\n'.format(scale))
@@ -47,9 +125,18 @@ def display_bandwidth(stream, processor, args, **kwargs):
 def display_ip_bandwidth(stream, processor, resolver, args):
     scale = args.scale
     top = args.top
-    stream.write('# IP bandwidth ({})\n'.format(scale))
     if resolver is not None:
+        # resolve a copy, so later snapshots still start from raw IPs
+        processor = _copy.deepcopy(processor)
         processor.resolve(resolver=resolver, top=top)
+    if processor.capacity and processor.ip_bytes:
+        error = processor.bandwidth(
+            scale=scale, _bytes=processor.max_ip_error())
+        stream.write(
+            '# IP bandwidth ({}, each up to {} too high)\n'.format(
+                scale, error))
+    else:
+        stream.write('# IP bandwidth ({})\n'.format(scale))
     remaining = processor.bandwidth(scale=scale)
     for ip,bw in processor.ip_bandwidth(
         scale=scale, sort_by_bandwidth=True)[-1:-top:-1]:
@@ -68,9 +155,13 @@ def display_ip_bandwidth(stream, processor, resolver, args):
 
 def display_set(stream, processor, **kwargs):
     stream.write('# Value sets\n')
-    for key,values in sorted(processor.values.items()):
-        stream.write('{}\n'.format(key))
-        for value in sorted(values):
+    for key in sorted(processor.fields):
+        if processor.approximate:
+            count,error = processor.count(key)
+            stream.write('{}\t~{} (+/-{:.1%})\n'.format(key, count, error))
+        else:
+            stream.write('{}\n'.format(key))
+        for value in processor.sample(key):
             stream.write('\t{}\n'.format(value))
 
 def display_status(stream, processor, **kwargs):
@@ -83,6 +174,27 @@ def display_status(stream, processor, **kwargs):
         for r in sorted(request):
             stream.write('\t{}\n'.format(r))
 
+def display_status_count(stream, processor, args, **kwargs):
+    stream.write('# Status counts\n')
+    for status,requests in sorted(
+            processor.status_counts(top=args.status_top).items()):
+        stream.write('{}\n'.format(status))
+        for request,count in requests:
+            stream.write('\t{}\t{}\n'.format(count, request))
+
+def display_time_series(stream, processor, args, **kwargs):
+    scale = args.scale
+    stream.write('# Time series ({})\n'.format(processor.interval))
+    if processor.first is not None:
+        epoch,b = processor.peak('bytes')
+        bw = _BandwidthProcessor._scales[scale] * b / float(processor.width)
+        stream.write('# Peak bandwidth {} ({}) at {}\n'.format(
+                bw, scale, _epoch_time(epoch).isoformat()))
+    if args.series_format == 'ndjson':
+        processor.write_ndjson(stream)
+    else:
+        processor.write_csv(stream)
+
 
 if __name__ == '__main__':
     import argparse
@@ -101,28 +213,87 @@ if __name__ == '__main__':
     parser.add_argument(
         '-r', '--resolve', default=False, action='store_const', const=True,
         help='Resolve IP addresses for bandwidth measurements')
+    parser.add_argument(
+        '--resolve-cache', metavar='PATH',
+        help='SQLite database for caching resolved IP addresses between runs')
     parser.add_argument(
         '-t', '--top', default=10, type=int,
         help='Number of IPs to print for ip-bandwidth measurements')
+    parser.add_argument(
+        '--ip-capacity', metavar='N', type=int,
+        help=('Only track the (approximately) top N IPs for ip-bandwidth '
+              'measurements, bounding memory use'))
     parser.add_argument(
         '-s', '--scale', default='MB/month',
         choices=sorted(_BandwidthProcessor._scales.keys()),
         help='Scale for the bandwidth processors')
+    parser.add_argument(
+        '--status-top', metavar='N', type=int,
+        help='Number of requests to print per status for status-count')
+    parser.add_argument(
+        '--bucket', default='hour',
+        choices=sorted(_TimeSeriesProcessor.INTERVALS.keys()),
+        help='Bucket width for the time-series processor')
+    parser.add_argument(
+        '--series-format', default='csv', choices=['csv', 'ndjson'],
+        help='Output format for the time-series processor')
     parser.add_argument(
         '-k', '--key', action='append', help='Add a key to the set processor')
+    parser.add_argument(
+        '--approximate', default=False, action='store_const', const=True,
+        help=('Count distinct values for the set processor approximately, '
+              'in bounded memory'))
+    parser.add_argument(
+        '--precision', default=12, type=int,
+        help=('HyperLogLog precision for --approximate (2**PRECISION '
+              'bytes per key)'))
+    parser.add_argument(
+        '--sample', default=10, type=int,
+        help='Number of sample values to print with --approximate')
+    parser.add_argument(
+        '-j', '--jobs', default=1, type=int,
+        help='Number of processes to parse the files with')
+    parser.add_argument(
+        '--gzip-index', default=False, action='store_const', const=True,
+        help=('Build seek indexes for gzipped files (saved next to them), '
+              'so --jobs can split them'))
+    parser.add_argument(
+        '--pipe', default=False, action='store_const', const=True,
+        help=('Decompress files in external processes (e.g. pigz) '
+              'when available'))
+    parser.add_argument(
+        '--state', metavar='PATH',
+        help=('Resume from (and update) the processing state saved in PATH, '
+              'only processing new lines'))
+    parser.add_argument(
+        '--follow', default=False, action='store_const', const=True,
+        help='Follow a single growing log file (handles log rotation)')
+    parser.add_argument(
+        '--from-end', default=False, action='store_const', const=True,
+        help='With --follow, skip the lines already in the file')
+    parser.add_argument(
+        '--interval', default=60, type=float,
+        help='Seconds between snapshots with --follow')
+    parser.add_argument(
+        '--snapshot', metavar='PATH',
+        help='With --follow, write snapshots to PATH instead of stdout')
     parser.add_argument(
         'file', nargs='+', help='Path to log file')
 
     args = parser.parse_args()
+    if args.follow and len(args.file) != 1:
+        parser.error('--follow takes a single log file')
+    if args.state and (args.follow or args.jobs > 1):
+        parser.error('--state cannot be used with --follow or --jobs')
 
     if hasattr(_socket, 'setdefaulttimeout'):
         _socket.setdefaulttimeout(5)  # set 5 second timeout
 
-    fmt = _FORMATS.get(args.format, args.format)
-    parser = _Parser(fmt)
-
     if args.resolve:
-        resolver = _Resolver(smart=True)
+        cache = None
+        if args.resolve_cache:
+            cache = _SQLiteCache(args.resolve_cache)
+        resolver = _Resolver(smart=True, timeout=5, cache=cache)
     else:
         resolver = None
 
@@ -132,17 +303,49 @@ if __name__ == '__main__':
         if not getattr(args, pattr):
             continue
         kwargs = {}
+        if pattr == 'ip_bandwidth':
+            kwargs['capacity'] = args.ip_capacity
+        if pattr == 'time_series':
+            kwargs['interval'] = args.bucket
         if pattr == 'set':
             kwargs['keys'] = args.key
+            if args.approximate:
+                kwargs.update({
+                    'approximate': True,
+                    'precision': args.precision,
+                    'sample': args.sample,
+                    })
         p = PROCESSORS[processor](**kwargs)
         processors.append(p)
 
-    for filename in args.file:
-        with _open(filename) as f:
-            _process(stream=f, parser=parser, processors=processors)
-    for processor in processors:
-        display_processor(
-            stream=sys.stdout, processor=processor, resolver=resolver,
-            args=args)
-        if processor != processors[-1]:
-            print ''  # blank line between output blocks
+    if args.state:
+        state = _State.load(args.state)
+        try:
+            state.check_processors(processors)
+        except ValueError as e:
+            parser.error(str(e))
+
+    fmt = _FORMATS.get(args.format, args.format)
+    parser = _Parser(fmt, fields=_required_fields(processors))
+
+    if args.follow:
+        follow(filename=args.file[0], parser=parser, processors=processors,
+               resolver=resolver, args=args)
+        sys.exit(0)
+    elif args.jobs > 1:
+        _process_files(
+            filenames=args.file, parser=parser, processors=processors,
+            jobs=args.jobs, gzip_index=args.gzip_index)
+    elif args.state:
+        for filename in args.file:
+            with state.open(filename, pipe=args.pipe) as f:
+                _process(stream=f, parser=parser, processors=processors)
+        processors = state.merge_processors(processors)
+        state.save(args.state)
+    else:
+        for filename in args.file:
+            with _open(filename, pipe=args.pipe) as f:
+                _process(stream=f, parser=parser, processors=processors)
+    display_processors(
+        stream=sys.stdout, processors=processors, resolver=resolver,
+        args=args)
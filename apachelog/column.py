@@ -0,0 +1,244 @@
+"""Columnar batches of parsed log lines.
+
+``Parser.parse_columns`` returns the fields of a batch of lines as one
+column per field instead of one dictionary per line.  Numeric
+directives (see ``TYPECODES``) become ``array.array`` columns (or
+NumPy arrays, if you ask for them and NumPy is installed), and every
+other field becomes an ``EncodedColumn``, which stores each distinct
+string once plus an array of integer codes.
+
+>>> from apachelog.parser import Parser, FORMATS
+>>> parser = Parser(FORMATS['common'])
+>>> lines = [
+...     '192.168.0.1 - - [18/Feb/2012:10:25:43 -0500] "GET / HTTP/1.1" 200 560',
+...     '192.168.0.1 - - [18/Feb/2012:10:25:43 -0500] "GET /style.css HTTP/1.1" 200 8240',
+...     '192.168.0.2 - - [18/Feb/2012:10:25:58 -0500] "GET / HTTP/1.1" 404 -',
+...     ]
+>>> for batch in parser.parse_columns(lines, batch_size=2):
+...     print(len(batch))
+...     print(batch['%b'])
+...     print(batch['%h'].values)
+...     print(batch['%h'].codes)
+2
+array('l', [560, 8240])
+['192.168.0.1']
+array('l', [0, 0])
+1
+array('l', [0])
+['192.168.0.2']
+array('l', [0])
+"""
+
+import array as _array
+
+try:
+    import numpy as _numpy
+except ImportError as e:
+    _numpy = None
+    _numpy_import_error = e
+
+
+"""
+``array`` typecodes for the numeric directives
+"""
+TYPECODES = {
+    '%>s': 'l',
+    '%s': 'l',
+    '%B': 'l',
+    '%b': 'l',
+    '%D': 'l',
+    '%O': 'l',
+    '%I': 'l',
+    '%t': 'l',
+    '%T': 'd',
+    }
+
+
+class EncodedColumn (object):
+    """A dictionary-encoded column.
+
+    ``values`` lists the distinct values in order of first appearance
+    and ``codes`` holds the index into ``values`` for each row.
+
+    >>> c = EncodedColumn.encode(['GET', 'POST', 'GET'])
+    >>> c.values
+    ['GET', 'POST']
+    >>> c.codes
+    array('l', [0, 1, 0])
+    >>> list(c)
+    ['GET', 'POST', 'GET']
+    >>> c[1]
+    'POST'
+    """
+    def __init__(self, codes, values):
+        self.codes = codes
+        self.values = values
+
+    @classmethod
+    def encode(cls, items):
+        index = {}
+        setdefault = index.setdefault
+        codes = _array.array('l', [setdefault(v, len(index)) for v in items])
+        values = [None] * len(index)
+        for value,i in index.items():
+            values[i] = value
+        return cls(codes=codes, values=values)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, i):
+        return self.values[self.codes[i]]
+
+    def __iter__(self):
+        values = self.values
+        return (values[code] for code in self.codes)
+
+
+class Batch (object):
+    """A batch of parsed lines, stored by column.
+
+    Index a batch with a field name to get its column, or use raw
+    to get the unconverted values the parser kept for it.
+    """
+    def __init__(self, columns, names, raw_columns=None):
+        self.columns = columns
+        self._names = names
+        self.raw_columns = raw_columns or {}
+
+    def __len__(self):
+        if not self._names:
+            return 0
+        return len(self.columns[self._names[0]])
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def __contains__(self, name):
+        return name in self.columns
+
+    def names(self):
+        return self._names
+
+    def raw(self, name):
+        """Return the unconverted column for name.
+
+        Falls back to the regular column if the parser did not keep
+        the unconverted values (because it never converted them).
+        """
+        try:
+            return self.raw_columns[name]
+        except KeyError:
+            return self.columns[name]
+
+    def records(self):
+        """Iterate through the batch as one dictionary per line.
+        """
+        from .parser import AttrDict
+        columns = [self.columns[name] for name in self._names]
+        for row in zip(*columns):
+            yield AttrDict(zip(self._names, row))
+
+
+def numeric_column(typecode, items, numpy=False):
+    """Build a column of numbers from an iterable of numbers.
+    """
+    column = _array.array(typecode, items)
+    if numpy:
+        if _numpy is None:
+            raise _numpy_import_error
+        return _numpy.frombuffer(column, dtype=column.typecode).copy()
+    return column
+
+
+def encoded_column(items, numpy=False):
+    """Build an ``EncodedColumn`` from an iterable of values.
+    """
+    column = EncodedColumn.encode(items)
+    if numpy:
+        if _numpy is None:
+            raise _numpy_import_error
+        column.codes = _numpy.frombuffer(
+            column.codes, dtype=column.codes.typecode).copy()
+    return column
+
+
+def _is_numpy(column):
+    return _numpy is not None and isinstance(column, _numpy.ndarray)
+
+
+def total(column):
+    """Return the sum of a numeric column as a Python number.
+
+    >>> total(_array.array('l', [1, 2, 3]))
+    6
+    """
+    if _is_numpy(column):
+        return column.sum().item()
+    return sum(column)
+
+
+def extremes(column):
+    """Return the ``(minimum, maximum)`` of a non-empty numeric column.
+
+    >>> extremes(_array.array('l', [5, 2, 9]))
+    (2, 9)
+    """
+    if _is_numpy(column):
+        return (column.min().item(), column.max().item())
+    return (min(column), max(column))
+
+
+def argextremes(column):
+    """Return the indexes of the first minimum and maximum of a column.
+
+    >>> argextremes(_array.array('l', [5, 2, 9, 2]))
+    (1, 2)
+    """
+    if _is_numpy(column):
+        return (int(column.argmin()), int(column.argmax()))
+    low,high = extremes(column)
+    return (column.index(low), column.index(high))
+
+
+def group_totals(codes, weights):
+    """Sum ``weights`` grouped by ``codes``.
+
+    Returns a list of ``(code, total)`` pairs for the codes that
+    appear, in increasing code order.  With NumPy arrays this is a
+    sort-reduce rather than a Python loop.
+
+    >>> group_totals(_array.array('l', [1, 0, 1]),
+    ...              _array.array('l', [10, 20, 30]))
+    [(0, 20), (1, 40)]
+    """
+    if _is_numpy(codes):
+        if not len(codes):
+            return []
+        order = codes.argsort(kind='mergesort')
+        codes = codes[order]
+        starts = _numpy.flatnonzero(
+            _numpy.concatenate(([True], codes[1:] != codes[:-1])))
+        totals = _numpy.add.reduceat(_numpy.asarray(weights)[order], starts)
+        return list(zip(codes[starts].tolist(), totals.tolist()))
+    totals = {}
+    for code,weight in zip(codes, weights):
+        totals[code] = totals.get(code, 0) + weight
+    return sorted(totals.items())
+
+
+def distinct_pairs(a, b):
+    """Return the distinct ``(a[i], b[i])`` pairs in two columns.
+
+    >>> sorted(distinct_pairs(_array.array('l', [0, 1, 0]),
+    ...                       _array.array('l', [200, 404, 200])))
+    [(0, 200), (1, 404)]
+    """
+    if _is_numpy(a):
+        if not len(a):
+            return []
+        b_values, b_codes = _numpy.unique(b, return_inverse=True)
+        n = len(b_values)
+        pairs = _numpy.unique(a.astype(_numpy.int64) * n + b_codes)
+        return list(zip((pairs // n).tolist(), b_values[pairs % n].tolist()))
+    return list(set(zip(a, b)))
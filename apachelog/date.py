@@ -10,8 +10,15 @@ An alternative funtion, ``parse_time``, parses the data into
 ``datetime.datetime`` instances, which may be slower, but it does take
 the offset into account.  It also makes it easy to calculate time
 differences.
+
+Busy logs have many consecutive lines with the same ``%t``, so if
+you're parsing every line, use the memoized ``cached_parse_time`` or
+``cached_parse_epoch`` (see ``CachedParser``).
 """
 
+from __future__ import division
+
+import calendar as _calendar
 import datetime as _datetime
 
 
@@ -58,6 +65,43 @@ def parse_date(date):
     return (''.join(elems),date[21:])
 
 
+def parse_epoch(date):
+    """Convert a date to integer seconds since the epoch (in UTC).
+
+    Takes a date in the same format as ``parse_date``, but does take
+    the offset into account.
+
+    >>> parse_epoch('[12/Feb/2012:09:55:33 -0500]')
+    1329058533
+    >>> parse_epoch('[12/Feb/2012:14:55:33 +0000]')
+    1329058533
+    """
+    date = date.strip('[]')
+    soff = int(date[21:22] + '1')
+    offset = soff * (int(date[22:24])*3600 + int(date[24:26])*60)
+    return _calendar.timegm((
+            int(date[7:11]),
+            int(MONTHS[date[3:6]]),
+            int(date[0:2]),
+            int(date[12:14]),
+            int(date[15:17]),
+            int(date[18:20]),
+            )) - offset
+
+
+def parse_epoch_offset(date):
+    """Convert a date to an (`epoch`, `offset`) tuple.
+
+    Like ``parse_epoch``, but the offset is returned as well, for
+    converting back to local time with ``epoch_time``.
+
+    >>> parse_epoch_offset('[12/Feb/2012:09:55:33 -0500]')
+    (1329058533, '-0500')
+    """
+    date = date.strip('[]')
+    return (parse_epoch(date), date[21:26])
+
+
 class FixedOffset(_datetime.tzinfo):
     """Fixed offset in minutes east from UTC.
 
@@ -86,6 +130,41 @@ class FixedOffset(_datetime.tzinfo):
     def dst(self, dt):
         return self._ZERO
 
+    def __reduce__(self):
+        return (self.__class__, (self._name,), self.__dict__)
+
+
+_OFFSETS = {}
+
+def get_offset(name):
+    """Return the shared ``FixedOffset`` for an offset like ``-0500``.
+
+    >>> tz = get_offset('-0530')
+    >>> tz.utcoffset(dt=None)
+    datetime.timedelta(-1, 66600)
+    >>> get_offset('-0530') is tz
+    True
+    """
+    try:
+        return _OFFSETS[name]
+    except KeyError:
+        soff = int(name[0:1] + '1')
+        tz = FixedOffset(
+            name, hours=soff*int(name[1:3]), minutes=soff*int(name[3:5]))
+        return _OFFSETS.setdefault(name, tz)
+
+
+def epoch_time(epoch, offset='+0000'):
+    """Convert epoch seconds to a ``datetime.datetime`` in ``offset``.
+
+    >>> print(epoch_time(1329058533, '-0500'))
+    2012-02-12 09:55:33-05:00
+    >>> print(epoch_time(1329058533))
+    2012-02-12 14:55:33+00:00
+    """
+    return _datetime.datetime.fromtimestamp(epoch, get_offset(offset))
+
+
 def parse_time(date):
     """
     >>> import time
@@ -96,11 +175,7 @@ def parse_time(date):
     1329076533.0
     """
     date = date.strip('[]')
-    tzdate = date[21:].strip()
-    soff = int(date[21:22] + '1')
-    hoff = int(date[22:24])
-    moff = int(date[24:])
-    tz = FixedOffset(tzdate, hours=soff*hoff, minutes=soff*moff)
+    tz = get_offset(date[21:].strip())
     return _datetime.datetime(
         year=int(date[7:11]),
         month=int(MONTHS[date[3:6]]),
@@ -110,3 +185,161 @@ def parse_time(date):
         second=int(date[18:20]),
         microsecond=int(0),
         tzinfo=tz)
+
+
+class CachedParser (object):
+    """Memoize a date parser such as ``parse_time`` or ``parse_epoch``.
+
+    The most recent date is checked first, and then a small
+    least-recently-used cache.  The cache is kept in two generations
+    of at most ``size`` dates each, so it only costs a couple of
+    dictionary lookups.  ``hits`` and ``misses`` count the lookups.
+
+    >>> parse = CachedParser(parse_time, size=2)
+    >>> for date in ['[12/Feb/2012:09:55:33 -0500]',
+    ...              '[12/Feb/2012:09:55:33 -0500]',
+    ...              '[12/Feb/2012:09:55:34 -0500]',
+    ...              '[12/Feb/2012:09:55:33 -0500]',
+    ...              '[12/Feb/2012:09:55:35 -0500]',
+    ...              '[12/Feb/2012:09:55:36 -0500]',
+    ...              '[12/Feb/2012:09:55:37 -0500]',
+    ...              '[12/Feb/2012:09:55:33 -0500]']:
+    ...     print(parse(date))
+    2012-02-12 09:55:33-05:00
+    2012-02-12 09:55:33-05:00
+    2012-02-12 09:55:34-05:00
+    2012-02-12 09:55:33-05:00
+    2012-02-12 09:55:35-05:00
+    2012-02-12 09:55:36-05:00
+    2012-02-12 09:55:37-05:00
+    2012-02-12 09:55:33-05:00
+    >>> (parse.hits, parse.misses)
+    (2, 6)
+    >>> parse.hit_rate()
+    0.25
+    """
+    def __init__(self, parse=parse_time, size=1024):
+        self.parse = parse
+        self.size = size
+        self.clear()
+
+    def clear(self):
+        self._recent = {}
+        self._older = {}
+        self._last_date = self._last_value = None
+        self.hits = self.misses = 0
+
+    def __call__(self, date):
+        if date == self._last_date:
+            self.hits += 1
+            return self._last_value
+        value = self._recent.get(date)
+        if value is None:
+            value = self._older.get(date)
+            if value is None:
+                self.misses += 1
+                value = self.parse(date)
+            else:
+                self.hits += 1
+            if len(self._recent) >= self.size:
+                self._older = self._recent
+                self._recent = {}
+            self._recent[date] = value
+        else:
+            self.hits += 1
+        self._last_date = date
+        self._last_value = value
+        return value
+
+    def hit_rate(self):
+        """Return the fraction of lookups that were found in the cache.
+        """
+        lookups = self.hits + self.misses
+        if not lookups:
+            return 0
+        return self.hits / lookups
+
+
+class _MinuteCachedParser (CachedParser):
+    """A ``CachedParser`` with cheap cache misses.
+
+    The parsed value for the start of each minute (and offset) is
+    remembered, so a miss only has to add the seconds.
+    """
+    def __init__(self, parse, size=1024):
+        super(_MinuteCachedParser, self).__init__(
+            parse=self._parse_seconds, size=size)
+        self._parse_minute = parse
+
+    def clear(self):
+        super(_MinuteCachedParser, self).clear()
+        self._minutes = {}
+
+    def _parse_seconds(self, date):
+        date = date.strip('[]')
+        minute = date[:18] + date[20:]
+        base = self._minutes.get(minute)
+        if base is None:
+            if len(self._minutes) >= self.size:
+                self._minutes.clear()
+            base = self._parse_minute(minute[:18] + '00' + minute[18:])
+            self._minutes[minute] = base
+        return self._add_seconds(base, int(date[18:20]))
+
+
+class CachedTimeParser (_MinuteCachedParser):
+    """A ``CachedParser`` for ``parse_time``.
+
+    >>> parse = CachedTimeParser()
+    >>> print(parse('[12/Feb/2012:09:55:33 -0500]'))
+    2012-02-12 09:55:33-05:00
+    >>> print(parse('[12/Feb/2012:09:55:59 -0500]'))
+    2012-02-12 09:55:59-05:00
+    >>> print(parse('[12/Feb/2012:14:55:33 +0000]'))
+    2012-02-12 14:55:33+00:00
+    >>> (parse.hits, parse.misses)
+    (0, 3)
+    """
+    def __init__(self, size=1024):
+        super(CachedTimeParser, self).__init__(parse=parse_time, size=size)
+
+    def _add_seconds(self, base, seconds):
+        return base.replace(second=seconds)
+
+
+class CachedEpochParser (_MinuteCachedParser):
+    """A ``CachedParser`` for ``parse_epoch``.
+
+    >>> parse = CachedEpochParser()
+    >>> parse('[12/Feb/2012:09:55:33 -0500]')
+    1329058533
+    >>> parse('[12/Feb/2012:09:55:59 -0500]')
+    1329058559
+    >>> parse('[12/Feb/2012:14:55:33 +0000]')
+    1329058533
+    """
+    def __init__(self, size=1024):
+        super(CachedEpochParser, self).__init__(parse=parse_epoch, size=size)
+
+    def _add_seconds(self, base, seconds):
+        return base + seconds
+
+
+class CachedEpochOffsetParser (_MinuteCachedParser):
+    """A ``CachedParser`` for ``parse_epoch_offset``.
+
+    >>> parse = CachedEpochOffsetParser()
+    >>> parse('[12/Feb/2012:09:55:33 -0500]')
+    (1329058533, '-0500')
+    """
+    def __init__(self, size=1024):
+        super(CachedEpochOffsetParser, self).__init__(
+            parse=parse_epoch_offset, size=size)
+
+    def _add_seconds(self, base, seconds):
+        return (base[0] + seconds, base[1])
+
+
+cached_parse_time = CachedTimeParser()
+cached_parse_epoch = CachedEpochParser()
+cached_parse_epoch_offset = CachedEpochOffsetParser()
@@ -1,6 +1,289 @@
 import __builtin__
+import bz2 as _bz2
+import distutils.spawn as _distutils_spawn
+import errno as _errno
 import gzip as _gzip
+import io as _io
+import itertools as _itertools
+import mmap as _mmap
+import os as _os
 import os.path as _os_path
+import signal as _signal
+import subprocess as _subprocess
+import time as _time
+
+from . import gzindex as _gzindex
+
+try:
+    import lzma as _lzma
+except ImportError:
+    try:
+        from backports import lzma as _lzma
+    except ImportError:
+        _lzma = None
+
+
+"""Size of the blocks read from compressed streams
+"""
+BLOCK_SIZE = 1 << 20
+
+
+def iter_blocks(stream, block_size=BLOCK_SIZE):
+    """Iterate through lists of lines, reading large blocks at a time.
+
+    A partial line at the end of a block is carried over to the next
+    list.
+
+    >>> import StringIO
+    >>> stream = StringIO.StringIO('first line\\nsecond\\nthird line\\nlast')
+    >>> for lines in iter_blocks(stream, block_size=8):
+    ...     print(lines)
+    []
+    ['first line\\n']
+    ['second\\n']
+    ['third line\\n']
+    []
+    ['last']
+    """
+    read = stream.read
+    return _split_blocks(iter(lambda: read(block_size), ''))
+
+
+def _split_lines(data):
+    "Split ``data`` into lines, returning ``(lines, partial_line)``."
+    if '\r' in data:  # splitlines would break lines at bare '\r's
+        lines = [line + '\n' for line in data.split('\n')]
+        lines[-1] = lines[-1][:-1]
+    else:
+        lines = data.splitlines(True)
+    if lines and not lines[-1].endswith('\n'):
+        return (lines, lines.pop())
+    return (lines, '')
+
+
+def _split_blocks(blocks):
+    carry = ''
+    for block in blocks:
+        lines,carry = _split_lines(carry + block)
+        yield lines
+    if carry:
+        yield [carry]
+
+
+def iter_lines(stream, block_size=BLOCK_SIZE):
+    """Iterate through the lines in a stream, reading large blocks.
+
+    This is much faster than iterating through the lines of a
+    compressed stream (e.g. a ``gzip.GzipFile``) directly.
+
+    >>> import StringIO
+    >>> stream = StringIO.StringIO('first line\\nsecond\\nthird line\\nlast')
+    >>> list(iter_lines(stream, block_size=8))
+    ['first line\\n', 'second\\n', 'third line\\n', 'last']
+    """
+    return _itertools.chain.from_iterable(
+        iter_blocks(stream=stream, block_size=block_size))
+
+
+class BlockReader (object):
+    """Iterate through the lines of a stream with ``iter_lines``.
+
+    The reader closes the stream when it is closed, and can be used
+    as a context manager.
+    """
+    def __init__(self, stream, block_size=BLOCK_SIZE):
+        self.stream = stream
+        self.block_size = block_size
+
+    def __iter__(self):
+        return iter_lines(stream=self.stream, block_size=self.block_size)
+
+    def read(self, size=-1):
+        return self.stream.read(size)
+
+    def close(self):
+        self.stream.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+
+class PipeReader (object):
+    """Read the output of an external decompressor.
+
+    Decompressing in another process (e.g. ``gzip -dc`` or ``pigz
+    -dc``) lets decompression run on another core while we parse.
+    The file is passed on the command's standard input, and the
+    command should write the decompressed data to its standard
+    output.
+
+    >>> import os, tempfile
+    >>> fd,filename = tempfile.mkstemp()
+    >>> with os.fdopen(fd, 'w') as f:
+    ...     f.write('first line\\nsecond\\n')
+    >>> with PipeReader(['cat'], filename) as f:
+    ...     f.read()
+    'first line\\nsecond\\n'
+    >>> os.remove(filename)
+    """
+    def __init__(self, command, filename):
+        self.command = list(command)
+        with __builtin__.open(filename, 'rb') as stdin:
+            self._process = _subprocess.Popen(
+                self.command, stdin=stdin, stdout=_subprocess.PIPE,
+                bufsize=-1)
+        self._eof = False
+
+    def read(self, size=-1):
+        data = self._process.stdout.read(size)
+        if not data:
+            self._eof = True
+        return data
+
+    def __iter__(self):
+        return iter(self._process.stdout)
+
+    def close(self):
+        self._process.stdout.close()
+        status = self._process.wait()
+        # a decompressor killed because we stopped reading early is fine
+        if status and not (
+                status == -_signal.SIGPIPE and not self._eof):
+            raise IOError(
+                _errno.EIO, '{} exited with status {}'.format(
+                    ' '.join(self.command), status))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+
+class MappedFile (object):
+    """A memory-mapped, uncompressed log file.
+
+    Reading lines from the mapping avoids copying the file through
+    the buffers of a file object.  The ``mapping`` itself is exposed
+    for other readers, and ``ranges`` splits the file into
+    newline-aligned byte ranges (see ``byte_ranges``).
+
+    >>> import os, tempfile
+    >>> fd,filename = tempfile.mkstemp()
+    >>> with os.fdopen(fd, 'w') as f:
+    ...     f.write('first line\\nsecond\\nthird line\\nlast\\n')
+    >>> with MappedFile(filename) as f:
+    ...     print(list(f))
+    ...     print(f.ranges(2))
+    ...     print(list(f.iter_lines(11, 29)))
+    ['first line\\n', 'second\\n', 'third line\\n', 'last\\n']
+    [(0, 18), (18, 34)]
+    ['second\\n', 'third line\\n']
+    >>> os.remove(filename)
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        with __builtin__.open(filename, 'rb') as f:
+            self.size = _os.fstat(f.fileno()).st_size
+            if self.size:
+                self.mapping = _mmap.mmap(
+                    f.fileno(), 0, access=_mmap.ACCESS_READ)
+            else:  # empty files can't be mapped
+                self.mapping = ''
+
+    def line_start(self, pos):
+        """Return the start of the first line beginning at or after ``pos``.
+        """
+        if pos <= 0:
+            return 0
+        if pos >= self.size:
+            return self.size
+        i = self.mapping.find('\n', pos - 1)
+        if i < 0:
+            return self.size
+        return i + 1
+
+    def ranges(self, chunks):
+        """Split the file into at most ``chunks`` newline-aligned ranges.
+
+        See ``byte_ranges``.
+        """
+        bounds = [0]
+        for i in range(1, chunks):
+            pos = self.line_start(self.size * i // chunks)
+            if pos >= self.size:
+                break
+            if pos > bounds[-1]:
+                bounds.append(pos)
+        bounds.append(self.size)
+        return [(bounds[i], bounds[i+1]) for i in range(len(bounds) - 1)]
+
+    def iter_lines(self, start=0, end=None, block_size=BLOCK_SIZE):
+        """Iterate through the lines starting in a range of bytes.
+        """
+        start = self.line_start(start)
+        if end is None:
+            end = self.size
+        else:
+            end = self.line_start(end)
+        mapping = self.mapping
+        blocks = (mapping[pos:min(pos + block_size, end)]
+                  for pos in xrange(start, end, block_size))
+        return _itertools.chain.from_iterable(_split_blocks(blocks))
+
+    def __iter__(self):
+        return self.iter_lines()
+
+    def close(self):
+        if self.size:
+            self.mapping.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+
+"""External decompressors by file extension, in order of preference
+
+Each reads the compressed file from its standard input (see
+``PipeReader``).
+"""
+PIPE_COMMANDS = {
+    '.gz': [('pigz', '-dc'), ('gzip', '-dc')],
+    '.bz2': [('pbzip2', '-dc'), ('bzip2', '-dc')],
+    '.xz': [('pixz', '-d'), ('xz', '-dc')],
+    }
+
+
+def pipe_command(extension, commands=None):
+    """Return the first available decompressor for ``extension``.
+
+    Returns ``None`` if none of the commands in ``PIPE_COMMANDS`` (or
+    ``commands``) are installed.
+    """
+    if commands is None:
+        commands = PIPE_COMMANDS
+    for command in commands.get(extension, []):
+        if _distutils_spawn.find_executable(command[0]):
+            return command
+    return None
+
+
+def _xz_open(filename, mode='rb'):
+    if _lzma is not None:
+        return _lzma.open(filename, mode)
+    command = pipe_command('.xz')
+    if command is None:
+        raise IOError(
+            _errno.ENOENT,
+            'reading {} requires the lzma module or an xz executable'.format(
+                filename))
+    return PipeReader(command, filename)
 
 
 """Openers by file extention.
@@ -14,18 +297,204 @@ will work.
 """
 OPENERS = {
     '.gz': _gzip.open,
+    '.bz2': _bz2.BZ2File,
+    '.xz': _xz_open,
     }
 
 
-def open(filename, openers=None):
+def open(filename, openers=None, binary=False, block_size=BLOCK_SIZE,
+         pipe=False, mmap=False):
     """Utility method that decompresses files based on their extension.
 
     Uses ``OPENERS`` to determine the appropriate opener for the
     file's extension.  If the extension is not listed in ``OPENERS``,
     fall back to the ``open`` builtin.
+
+    Set ``binary`` to read undecoded lines, for use with a parser
+    created with ``Parser(format, binary=True)``.
+
+    Compressed streams are read in blocks of ``block_size`` bytes (see
+    ``iter_lines``); set it to ``None`` to iterate through the opened
+    stream directly.  Set ``pipe`` to decompress in an external process
+    (see ``PipeReader`` and ``PIPE_COMMANDS``) when one is available.
+    Set ``mmap`` to read uncompressed files through a ``MappedFile``.
+
+    >>> import bz2, os, tempfile
+    >>> fd,filename = tempfile.mkstemp(suffix='.bz2')
+    >>> os.close(fd)
+    >>> f = bz2.BZ2File(filename, 'w')
+    >>> f.write('first line\\nsecond\\n')
+    >>> f.close()
+    >>> with open(filename) as f:
+    ...     list(f)
+    ['first line\\n', 'second\\n']
+    >>> with open(filename, pipe=True) as f:
+    ...     list(f)
+    ['first line\\n', 'second\\n']
+    >>> os.remove(filename)
     """
     if openers is None:
         openers = OPENERS
     extension = _os_path.splitext(filename)[-1]
-    opener = openers.get(extension, __builtin__.open)
-    return opener(filename, 'r')
+    if extension not in openers:
+        if mmap:
+            return MappedFile(filename)
+        if binary:
+            return __builtin__.open(filename, 'rb')
+        return __builtin__.open(filename, 'r')
+    stream = None
+    if pipe:
+        command = pipe_command(extension)
+        if command is not None:
+            stream = PipeReader(command, filename)
+    if stream is None:
+        stream = openers[extension](filename, 'rb')
+    if block_size is None:
+        return stream
+    return BlockReader(stream, block_size=block_size)
+
+
+def byte_ranges(filename, chunks):
+    """Split an uncompressed file into byte ranges for parallel work.
+
+    Returns a list of at most ``chunks`` ``(start, end)`` tuples
+    covering the file, where each ``start`` is at the beginning of a
+    line.  Read a range with ``read_range`` (or
+    ``MappedFile.iter_lines``).
+    """
+    with MappedFile(filename) as f:
+        return f.ranges(chunks)
+
+
+def read_range(filename, start, end):
+    """Iterate through the lines starting in a range of bytes.
+
+    ``start`` should be at the beginning of a line (as with the
+    ranges from ``byte_ranges``).  Lines are not decoded.
+
+    Uncompressed files are read through a ``MappedFile``.  Gzipped
+    files are read through their saved index (see
+    ``apachelog.gzindex``), with ``start`` and ``end`` measured in
+    uncompressed bytes.
+
+    >>> import os, tempfile
+    >>> fd,filename = tempfile.mkstemp()
+    >>> with os.fdopen(fd, 'w') as f:
+    ...     f.write('first line\\nsecond\\nthird line\\nlast\\n')
+    >>> ranges = byte_ranges(filename, 3)
+    >>> ranges
+    [(0, 11), (11, 29), (29, 34)]
+    >>> for start,end in ranges:
+    ...     print(list(read_range(filename, start, end)))
+    ['first line\\n']
+    ['second\\n', 'third line\\n']
+    ['last\\n']
+    >>> os.remove(filename)
+    """
+    if _os_path.splitext(filename)[-1] == '.gz':
+        index = _gzindex.get_index(filename)
+        if index is None:
+            raise ValueError('no current index for {}'.format(filename))
+        for line in index.read_lines(filename, start, end):
+            yield line
+        return
+    with MappedFile(filename) as f:
+        for line in f.iter_lines(start, end):
+            yield line
+
+
+def follow(filename, poll_interval=1, block_size=BLOCK_SIZE, from_end=False):
+    """Follow a growing log file, like ``tail -F``.
+
+    Yields lists of complete lines as they are written.  When there is
+    no new data, an empty list is yielded (so you can do periodic work)
+    before sleeping for ``poll_interval`` seconds.  If the file is
+    rotated (it is replaced by a file with a different inode), the old
+    file is finished and the new one followed from its start.  If the
+    file is truncated (it becomes shorter than what we've read), it is
+    followed from its new start.  Set ``from_end`` to skip the lines
+    already in the file.
+
+    >>> import os, tempfile
+    >>> directory = tempfile.mkdtemp()
+    >>> filename = os.path.join(directory, 'access_log')
+    >>> log = __builtin__.open(filename, 'w', 0)
+    >>> log.write('first line\\nsecond')
+    >>> lines = follow(filename, poll_interval=0)
+    >>> next(lines)
+    ['first line\\n']
+    >>> next(lines)
+    []
+    >>> log.write(' line\\n')
+    >>> next(lines)
+    ['second line\\n']
+
+    Rotate the log.
+
+    >>> log.write('third line\\n')
+    >>> log.close()
+    >>> os.rename(filename, filename + '.1')
+    >>> log = __builtin__.open(filename, 'w', 0)
+    >>> log.write('new line\\n')
+    >>> next(lines)
+    ['third line\\n']
+    >>> next(lines)
+    ['new line\\n']
+
+    Truncate the log.
+
+    >>> log.truncate(0)
+    >>> log.seek(0)
+    >>> log.write('again\\n')
+    >>> next(lines)
+    ['again\\n']
+    >>> log.close()
+    >>> lines.close()
+    >>> for name in os.listdir(directory):
+    ...     os.remove(os.path.join(directory, name))
+    >>> os.rmdir(directory)
+    """
+    f = None
+    carry = ''
+    try:
+        while True:
+            if f is None:
+                try:
+                    # ``io`` files, unlike ``file``, can read past an EOF
+                    f = _io.open(filename, 'rb')
+                except IOError as e:
+                    if e.errno != _errno.ENOENT:
+                        raise
+                    yield []
+                    _time.sleep(poll_interval)
+                    continue
+                if from_end:
+                    f.seek(0, _os.SEEK_END)
+                    from_end = False
+                inode = _os.fstat(f.fileno()).st_ino
+            block = f.read(block_size)
+            if block:
+                lines,carry = _split_lines(carry + block)
+                if lines:
+                    yield lines
+                continue
+            try:
+                st = _os.stat(filename)
+            except OSError:
+                st = None  # rotated, but the new file isn't there yet
+            if st is not None and st.st_ino != inode:
+                f.close()
+                f = None
+                if carry:  # the rotated file's last line is complete
+                    yield [carry]
+                    carry = ''
+                continue
+            if st is not None and st.st_size < f.tell():
+                f.seek(0)
+                carry = ''
+                continue
+            yield []
+            _time.sleep(poll_interval)
+    finally:
+        if f is not None:
+            f.close()
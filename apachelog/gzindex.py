@@ -0,0 +1,406 @@
+"""Random access into gzipped logs.
+
+A gzip stream can normally only be decompressed from the start.
+Following zlib's ``zran.c`` example, ``build_index`` decompresses a
+file once and records a checkpoint every ``span`` bytes of output:
+the compressed and uncompressed offsets of a deflate block boundary,
+plus the 32 kB of output preceding it (the dictionary needed to
+resume from there).  ``GzipIndex.read_lines`` can then start
+decompressing at the checkpoint nearest any uncompressed offset,
+which lets several workers split a single ``.gz`` file between them.
+
+Indexes are saved next to the log (see ``index_path``) by
+``get_index``.  This module talks to zlib through ``ctypes``, because
+Python's ``zlib`` module does not expose ``inflatePrime``.
+
+>>> import gzip, os, tempfile
+>>> fd,filename = tempfile.mkstemp(suffix='.gz')
+>>> os.close(fd)
+>>> f = gzip.open(filename, 'wb')
+>>> f.writelines('line {} {}\\n'.format(i, i * 7919 % 10007)
+...             for i in range(20000))
+>>> f.close()
+>>> index = build_index(filename, span=50000)
+>>> [point.out for point in index.points]
+[0, 79816, 163461, 251734]
+>>> ranges = index.ranges(3)
+>>> ranges
+[(0, 79816), (79816, 163461), (163461, 306686)]
+>>> lines = []
+>>> for start,end in ranges:
+...     lines.extend(index.read_lines(filename, start, end))
+>>> lines == list(gzip.open(filename))
+True
+>>> list(index.read_lines(filename, 100000, 100030))
+['line 6791 311\\n', 'line 6792 8230\\n']
+>>> index.save(index_path(filename))
+>>> get_index(filename).points == index.points
+True
+>>> os.remove(index_path(filename))
+>>> os.remove(filename)
+"""
+
+import collections as _collections
+import ctypes as _ctypes
+import ctypes.util as _ctypes_util
+import errno as _errno
+import os as _os
+import struct as _struct
+import zlib as _zlib
+
+
+_libz_name = _ctypes_util.find_library('z')
+if _libz_name:
+    _libz = _ctypes.CDLL(_libz_name)
+    _libz.zlibVersion.restype = _ctypes.c_char_p
+else:
+    _libz = None
+
+
+_Z_OK = 0
+_Z_STREAM_END = 1
+_Z_NEED_DICT = 2
+_Z_BUF_ERROR = -5
+_Z_NO_FLUSH = 0
+_Z_BLOCK = 5
+
+_GZIP_BITS = 16 + 15  # expect a gzip header
+_RAW_BITS = -15  # raw deflate data
+
+_WINDOW_SIZE = 32768
+_CHUNK_SIZE = 1 << 16
+_OUTPUT_SIZE = 1 << 16
+
+
+class _ZStream (_ctypes.Structure):
+    _fields_ = [
+        ('next_in', _ctypes.c_void_p),
+        ('avail_in', _ctypes.c_uint),
+        ('total_in', _ctypes.c_ulong),
+        ('next_out', _ctypes.c_void_p),
+        ('avail_out', _ctypes.c_uint),
+        ('total_out', _ctypes.c_ulong),
+        ('msg', _ctypes.c_char_p),
+        ('state', _ctypes.c_void_p),
+        ('zalloc', _ctypes.c_void_p),
+        ('zfree', _ctypes.c_void_p),
+        ('opaque', _ctypes.c_void_p),
+        ('data_type', _ctypes.c_int),
+        ('adler', _ctypes.c_ulong),
+        ('reserved', _ctypes.c_ulong),
+        ]
+
+
+class _Inflater (object):
+    "A minimal ``ctypes`` wrapper around a zlib inflate stream."
+    def __init__(self, window_bits):
+        if _libz is None:
+            raise IOError(_errno.ENOENT, 'cannot find the zlib library')
+        self._stream = _ZStream()
+        self._input = None
+        self._output = _ctypes.create_string_buffer(_OUTPUT_SIZE)
+        self._check(_libz.inflateInit2_(
+                _ctypes.byref(self._stream), window_bits,
+                _libz.zlibVersion(), _ctypes.sizeof(_ZStream)))
+
+    def __del__(self):
+        if _libz is not None:
+            _libz.inflateEnd(_ctypes.byref(self._stream))
+
+    def _check(self, ret):
+        if ret < 0 and ret != _Z_BUF_ERROR:
+            raise IOError(_errno.EIO, 'zlib error {}: {}'.format(
+                    ret, self._stream.msg))
+        return ret
+
+    @property
+    def avail_in(self):
+        return self._stream.avail_in
+
+    @property
+    def data_type(self):
+        return self._stream.data_type
+
+    def set_input(self, data):
+        self._input = _ctypes.create_string_buffer(data, len(data))
+        self._stream.next_in = _ctypes.addressof(self._input)
+        self._stream.avail_in = len(data)
+
+    def unused_input(self):
+        "Return the input that has not been consumed yet."
+        return _ctypes.string_at(self._stream.next_in, self._stream.avail_in)
+
+    def prime(self, bits, value):
+        self._check(_libz.inflatePrime(
+                _ctypes.byref(self._stream), bits, value))
+
+    def set_dictionary(self, window):
+        self._check(_libz.inflateSetDictionary(
+                _ctypes.byref(self._stream), window, len(window)))
+
+    def inflate(self, flush=_Z_NO_FLUSH):
+        "Return ``(output, return_code)``."
+        self._stream.next_out = _ctypes.addressof(self._output)
+        self._stream.avail_out = _OUTPUT_SIZE
+        ret = _libz.inflate(_ctypes.byref(self._stream), flush)
+        if ret == _Z_NEED_DICT:
+            raise IOError(_errno.EIO, 'unexpected preset dictionary')
+        self._check(ret)
+        produced = _OUTPUT_SIZE - self._stream.avail_out
+        return (_ctypes.string_at(self._output, produced), ret)
+
+
+"""A checkpoint in a gzip file
+
+``out`` and ``in_`` are the uncompressed and compressed offsets.
+``bits`` is the number of bits of the byte before ``in_`` that
+belong to the next block, ``window`` holds the preceding 32 kB of
+output, and ``header`` is true if decompression starts at a gzip
+header (``in_`` is the start of a gzip member).
+"""
+Point = _collections.namedtuple(
+    'Point', ['out', 'in_', 'bits', 'window', 'header'])
+
+
+def _inflate(f, inflater, raw, flush=_Z_NO_FLUSH):
+    """Yield ``(output, inflater)`` pairs until the file ends.
+
+    Handles files with several gzip members.  ``inflater`` is yielded
+    so index builders can look at its state.  Data that can't be
+    decoded after the last complete member is ignored, like ``gzip``
+    does; anything else is an ``IOError``.
+    """
+    members = 0  # fully decoded
+    member_output = False
+    while True:
+        if not inflater.avail_in:
+            data = f.read(_CHUNK_SIZE)
+            if not data:
+                return
+            inflater.set_input(data)
+        try:
+            output,ret = inflater.inflate(flush)
+        except IOError:
+            if members and not member_output and not raw:
+                return  # trailing garbage after the last member
+            raise
+        if output:
+            member_output = True
+        yield (output, inflater)
+        if ret == _Z_STREAM_END:
+            members += 1
+            rest = inflater.unused_input()
+            if raw:  # skip the CRC and size trailer ourselves
+                while len(rest) < 8:
+                    data = f.read(_CHUNK_SIZE)
+                    if not data:
+                        return
+                    rest += data
+                rest = rest[8:]
+            inflater = _Inflater(_GZIP_BITS)
+            raw = False
+            member_output = False
+            inflater.set_input(rest)
+
+
+class GzipIndex (object):
+    "Checkpoints for random access into a gzip file."
+    _MAGIC = 'apachelog gzip index 1\n'
+    _HEADER = _struct.Struct('<QQQI')
+    _POINT = _struct.Struct('<QQBBI')
+
+    def __init__(self, points, size, source_size=None, source_mtime=None):
+        self.points = points
+        self.size = size  # uncompressed size
+        self.source_size = source_size
+        self.source_mtime = source_mtime
+
+    def is_current(self, filename):
+        "Return ``True`` if ``filename`` has not changed since indexing."
+        st = _os.stat(filename)
+        return (st.st_size, int(st.st_mtime)) == (
+            self.source_size, self.source_mtime)
+
+    def save(self, path):
+        "Save the index, replacing ``path`` atomically."
+        tmp = '{}.tmp'.format(path)
+        with open(tmp, 'wb') as f:
+            f.write(self._MAGIC)
+            f.write(self._HEADER.pack(
+                    self.source_size, self.source_mtime, self.size,
+                    len(self.points)))
+            for point in self.points:
+                window = _zlib.compress(point.window)
+                f.write(self._POINT.pack(
+                        point.out, point.in_, point.bits, point.header,
+                        len(window)))
+                f.write(window)
+        _os.rename(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            if f.read(len(cls._MAGIC)) != cls._MAGIC:
+                raise ValueError('{} is not a gzip index'.format(path))
+            source_size,source_mtime,size,count = cls._HEADER.unpack(
+                f.read(cls._HEADER.size))
+            points = []
+            for i in range(count):
+                out,in_,bits,header,length = cls._POINT.unpack(
+                    f.read(cls._POINT.size))
+                window = _zlib.decompress(f.read(length))
+                points.append(Point(out, in_, bits, window, bool(header)))
+        return cls(points=points, size=size, source_size=source_size,
+                   source_mtime=source_mtime)
+
+    def point_before(self, offset):
+        "Return the last checkpoint at or before an uncompressed offset."
+        point = self.points[0]
+        for p in self.points:
+            if p.out > offset:
+                break
+            point = p
+        return point
+
+    def ranges(self, chunks):
+        """Split the uncompressed data into at most ``chunks`` ranges.
+
+        The ranges start at checkpoints, so reading them with
+        ``read_lines`` doesn't decompress anything twice (except for
+        the end of the last line in each range).
+        """
+        bounds = [0]
+        for i in range(1, chunks):
+            point = self.point_before(self.size * i // chunks)
+            if point.out > bounds[-1]:
+                bounds.append(point.out)
+        if self.size > bounds[-1] or len(bounds) == 1:
+            bounds.append(self.size)
+        return [(bounds[i], bounds[i+1]) for i in range(len(bounds) - 1)]
+
+    def iter_blocks(self, filename, offset=0):
+        """Iterate through decompressed blocks, starting near ``offset``.
+
+        Returns ``(start, blocks)``, where ``start`` is the
+        uncompressed offset of the first block.
+        """
+        point = self.point_before(offset)
+        f = open(filename, 'rb')
+        f.seek(point.in_ - (1 if point.bits else 0))
+        if point.header:
+            inflater = _Inflater(_GZIP_BITS)
+        else:
+            inflater = _Inflater(_RAW_BITS)
+            if point.bits:
+                value = ord(f.read(1))
+                inflater.prime(point.bits, value >> (8 - point.bits))
+            inflater.set_dictionary(point.window)
+
+        def blocks():
+            with f:
+                for output,_ in _inflate(f, inflater, raw=not point.header):
+                    if output:
+                        yield output
+        return (point.out, blocks())
+
+    def read_lines(self, filename, start=0, end=None):
+        """Iterate through the lines starting in an uncompressed range.
+
+        As with ``apachelog.file.read_range``, each line starting at
+        or after ``start`` and before ``end`` is returned whole.
+        """
+        if end is None:
+            end = self.size
+        point = self.point_before(start)
+        base,blocks = self.iter_blocks(filename, offset=start)
+        if base:
+            previous = point.window[-1:]
+        else:
+            previous = '\n'
+        # ``carry`` starts with the byte before ``base``, so the first
+        # piece is never a whole line starting at or after ``base``.
+        carry = previous
+        pos = base - 1  # offset of carry[0]
+        first = True
+        for block in blocks:
+            block = carry + block
+            if '\r' in block:  # splitlines would break lines at bare '\r's
+                lines = [line + '\n' for line in block.split('\n')]
+                lines[-1] = lines[-1][:-1]
+            else:
+                lines = block.splitlines(True)
+            carry = lines.pop()
+            for line in lines:
+                if first:
+                    first = False
+                elif pos >= end:
+                    return
+                elif pos >= start:
+                    yield line
+                pos += len(line)
+        if carry and not first and start <= pos < end:
+            yield carry
+
+
+def build_index(filename, span=1 << 20):
+    """Build a ``GzipIndex`` with a checkpoint every ``span`` bytes.
+
+    Each checkpoint costs up to 32 kB (compressed) in the saved index.
+
+    >>> import os, tempfile
+    >>> fd,filename = tempfile.mkstemp(suffix='.gz')
+    >>> os.write(fd, 'not gzip\\n')
+    9
+    >>> os.close(fd)
+    >>> build_index(filename)
+    Traceback (most recent call last):
+      ...
+    IOError: [Errno 5] zlib error -3: incorrect header check
+    >>> os.remove(filename)
+    """
+    st = _os.stat(filename)
+    points = [Point(out=0, in_=0, bits=0, window='', header=True)]
+    total_out = 0
+    last = 0
+    window = ''
+    with open(filename, 'rb') as f:
+        inflater = _Inflater(_GZIP_BITS)
+        for output,inflater in _inflate(f, inflater, raw=False,
+                                        flush=_Z_BLOCK):
+            if output:
+                total_out += len(output)
+                window = (window + output)[-_WINDOW_SIZE:]
+            data_type = inflater.data_type
+            # at the end of a deflate block that isn't the last one
+            if (data_type & 128 and not data_type & 64 and
+                    total_out - last > span):
+                total_in = f.tell() - inflater.avail_in
+                points.append(Point(
+                        out=total_out, in_=total_in, bits=data_type & 7,
+                        window=window, header=False))
+                last = total_out
+    return GzipIndex(points=points, size=total_out, source_size=st.st_size,
+                     source_mtime=int(st.st_mtime))
+
+
+def index_path(filename):
+    "Return the path of the saved index for ``filename``."
+    return filename + '.idx'
+
+
+def get_index(filename, build=False, span=1 << 20):
+    """Load the saved index for ``filename``.
+
+    Returns ``None`` if there is no current index, unless ``build`` is
+    set, in which case a new index is built and saved.
+    """
+    path = index_path(filename)
+    if _os.path.exists(path):
+        index = GzipIndex.load(path)
+        if index.is_current(filename):
+            return index
+    if not build:
+        return None
+    index = build_index(filename, span=span)
+    index.save(path)
+    return index
@@ -0,0 +1,116 @@
+"""Process log files on several cores.
+
+``process_files`` is a parallel version of running
+``apachelog.processor.process`` on a list of files.  Uncompressed
+files are read through an ``apachelog.file.MappedFile`` and split
+into byte ranges that begin on line boundaries, gzipped files with a
+seek index (see ``apachelog.gzindex``) are split at its checkpoints,
+other compressed files are handled whole, and each range or file is
+parsed and processed in a separate process with its own parser and
+its own empty copies of the processors (see ``Processor.spawn``).  The results from the workers are merged into
+the processors you passed in (see ``Processor.merge``).
+
+>>> import os, tempfile
+>>> from apachelog.parser import Parser, FORMATS
+>>> from apachelog.processor.bandwidth import IPBandwidthProcessor
+>>> fd,filename = tempfile.mkstemp()
+>>> with os.fdopen(fd, 'w') as f:
+...     for i in range(1000):
+...         f.write('192.168.0.{} - - [18/Feb/2012:10:{:02d}:00 -0500] '
+...                 '"GET / HTTP/1.1" 200 100 "-" "-"\\n'.format(i % 4, i % 60))
+>>> bwp = IPBandwidthProcessor()
+>>> process_files([filename], Parser(FORMATS['extended']), [bwp],
+...               jobs=2, min_size=1000)
+>>> bwp.bytes
+100000
+>>> sorted(bwp.ip_bytes.items())  # doctest: +NORMALIZE_WHITESPACE
+[('192.168.0.0', 25000), ('192.168.0.1', 25000),
+ ('192.168.0.2', 25000), ('192.168.0.3', 25000)]
+>>> bwp.total_seconds()
+3540.0
+>>> os.remove(filename)
+"""
+
+import multiprocessing as _multiprocessing
+import os.path as _os_path
+
+from . import file as _file
+from . import gzindex as _gzindex
+from .processor import process as _process
+
+
+def tasks(filenames, chunks=1, min_size=1 << 20, openers=None,
+          gzip_index=False):
+    """List ``(filename, start, end)`` tasks for a list of files.
+
+    Uncompressed files of at least ``2*min_size`` bytes are split into
+    up to ``chunks`` ranges of at least ``min_size`` bytes, as are
+    gzipped files with a current index.  Set ``gzip_index`` to build
+    (and save) missing indexes.  Other files give a single task with
+    ``start`` and ``end`` set to ``None``.
+    """
+    if openers is None:
+        openers = _file.OPENERS
+    for filename in filenames:
+        extension = _os_path.splitext(filename)[-1]
+        if extension == '.gz':
+            index = _gzindex.get_index(filename, build=gzip_index)
+            if index is not None and index.size // min_size >= 2:
+                for start,end in index.ranges(
+                        min(chunks, index.size // min_size)):
+                    yield (filename, start, end)
+                continue
+        if extension in openers:
+            yield (filename, None, None)
+            continue
+        with _file.MappedFile(filename) as f:
+            n = min(chunks, f.size // min_size)
+            if n < 2:
+                ranges = [(None, None)]
+            else:
+                ranges = f.ranges(n)
+        for start,end in ranges:
+            yield (filename, start, end)
+
+
+def _process_task(args):
+    parser, processors, (filename, start, end) = args
+    if start is None:
+        with _file.open(filename, mmap=True) as stream:
+            _process(stream=stream, parser=parser, processors=processors)
+    else:
+        stream = _file.read_range(filename, start, end)
+        _process(stream=stream, parser=parser, processors=processors)
+    return processors
+
+
+def process_files(filenames, parser, processors, jobs=None, chunks=None,
+                  min_size=1 << 20, gzip_index=False):
+    """Process a list of log files using a pool of ``jobs`` processes.
+
+    ``jobs`` defaults to the number of CPUs, and each uncompressed file
+    is split into up to ``chunks`` pieces (``4*jobs`` by default) so
+    the work is spread evenly.  ``gzip_index`` is passed on to
+    ``tasks``.  When this returns, ``processors``
+    hold the merged results from all the workers.
+    """
+    if jobs is None:
+        jobs = _multiprocessing.cpu_count()
+    if chunks is None:
+        chunks = 4 * jobs
+    templates = [processor.spawn() for processor in processors]
+    work = [(parser, templates, task)
+            for task in tasks(filenames, chunks=chunks, min_size=min_size,
+                              gzip_index=gzip_index)]
+    pool = _multiprocessing.Pool(jobs)
+    try:
+        for results in pool.imap_unordered(_process_task, work):
+            for processor,result in zip(processors, results):
+                processor.merge(result)
+    except:
+        pool.terminate()
+        raise
+    else:
+        pool.close()
+    finally:
+        pool.join()
@@ -1,5 +1,10 @@
+import itertools as _itertools
+import operator as _operator
 import re
 
+from . import column as _column
+from .date import cached_parse_epoch as _parse_epoch
+
 
 class ApacheLogParserError(Exception):
     pass
@@ -13,6 +18,146 @@ class AttrDict(dict):
     def __getattr__(self, name):
         return self[name]
 
+
+class BytesAttrDict(AttrDict):
+    """
+    The records returned by a parser in binary mode.  Values are
+    the raw bytes from the log line; decode only the fields you
+    need with the text method.
+    """
+    def text(self, name, encoding='utf-8', errors='replace'):
+        return self[name].decode(encoding, errors)
+
+
+class Record(tuple):
+    """
+    Base class for the compact records returned by
+    Parser(format, compact=True).
+
+    Records are tuples of the captured values, in format order, so
+    they take much less memory than a dictionary.  Values can be
+    looked up by position, by format directive or friendly name
+    (like a dictionary), or as attributes using the friendly names.
+    Use record_class to make the class for a particular format.
+    """
+    __slots__ = ()
+    _fields = ()
+    _aliases = ()
+    _index = {}
+    _base = None
+
+    def __getitem__(self, key, _getitem=tuple.__getitem__):
+        try:
+            return _getitem(self, self._index[key])
+        except KeyError:
+            if isinstance(key, (int, long)):
+                return _getitem(self, key)
+            raise
+        except TypeError:  # slices
+            return _getitem(self, key)
+
+    def get(self, key, default=None):
+        try:
+            return tuple.__getitem__(self, self._index[key])
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def keys(self):
+        return list(self._fields)
+
+    def items(self):
+        return list(zip(self._fields, self))
+
+    def __reduce__(self):
+        # the generated classes aren't module attributes, so pickle
+        # the arguments that made them
+        return (_make_record, (
+                self.__class__.__name__, self._fields, self._aliases,
+                self._base, tuple(self)))
+
+    def _asdict(self):
+        return AttrDict(zip(self._fields, self))
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__, ', '.join(
+                '%s=%r' % item for item in zip(self._fields, self)))
+
+
+class BytesRecord(Record):
+    """
+    The compact records returned by a parser in binary mode.  Like
+    BytesAttrDict, decode only the fields you need with the text
+    method.
+    """
+    __slots__ = ()
+
+    def text(self, name, encoding='utf-8', errors='replace'):
+        return self[name].decode(encoding, errors)
+
+
+def record_class(fields, aliases=(), name='Record', base=Record):
+    """
+    Makes a Record subclass with the field names fields.  aliases
+    is a list of other names (e.g. friendly names) for each field;
+    the names that are valid identifiers become attributes.  Pass
+    base=BytesRecord for records holding bytes values.
+
+    >>> R = record_class(['%h', '%>s'], [['remote_host', 'last_status']])
+    >>> r = R(['192.168.0.1', '200'])
+    >>> r
+    Record(%h='192.168.0.1', %>s='200')
+    >>> r[0], r['%h'], r['remote_host'], r.remote_host
+    ('192.168.0.1', '192.168.0.1', '192.168.0.1', '192.168.0.1')
+    >>> r.get('%b', '-')
+    '-'
+    >>> 'remote_host' in r, '192.168.0.1' in r
+    (True, False)
+    >>> B = record_class(['%h'], base=BytesRecord)
+    >>> B([b'192.168.0.1']).text('%h')
+    u'192.168.0.1'
+
+    Records pickle by value, rebuilding their class on load.
+
+    >>> import pickle
+    >>> r2 = pickle.loads(pickle.dumps(r, pickle.HIGHEST_PROTOCOL))
+    >>> r2 == r, r2.remote_host
+    (True, '192.168.0.1')
+    """
+    index = {}
+    attributes = {
+        '__slots__': (),
+        '_fields': tuple(fields),
+        '_aliases': tuple(tuple(names) for names in aliases),
+        '_index': index,
+        '_base': base,
+        }
+    for names in list(aliases) + [fields]:
+        for i,key in enumerate(names):
+            index[key] = i
+            if (_IDENTIFIER.match(key) and not hasattr(base, key)
+                    and not key.startswith('_')):
+                attributes[key] = property(_operator.itemgetter(i))
+    return type(name, (base,), attributes)
+
+
+_record_classes = {}
+
+
+def _make_record(name, fields, aliases, base, values):
+    """
+    Unpickles a record, sharing one class per set of record_class
+    arguments.
+    """
+    key = (name, fields, aliases, base)
+    cls = _record_classes.get(key)
+    if cls is None:
+        cls = _record_classes[key] = record_class(
+            fields, aliases, name, base)
+    return cls(values)
+
 """
 Frequenty used log formats stored here
 """
@@ -32,7 +177,186 @@ FORMATS = {
     }
 
 
+def clf_int(value):
+    """
+    Converts a byte count in CLF format, where '-' means no bytes
+    were sent.
+    """
+    try:
+        return int(value)
+    except ValueError:
+        if value.strip() in ('-', b'-'):
+            return 0
+        raise
+
+
+"""
+Converters for Parser(format, converters=True)
+"""
+CONVERTERS = {
+    '%>s': int,
+    '%s': int,
+    '%B': int,
+    '%D': int,
+    '%O': int,
+    '%I': int,
+    '%b': clf_int,
+    '%t': _parse_epoch,
+    '%T': float,
+    }
+
+"""
+Low-cardinality directives whose values are shared between records
+"""
+INTERNED = ('%>s', '%s', '%m', '%H', '%v')
+
+
+def _interner(func=None):
+    """
+    Returns a function that converts values with func (if any) and
+    then returns the first equal value it has seen.
+    """
+    table = {}
+    setdefault = table.setdefault
+    if func is None:
+        return lambda value: setdefault(value, value)
+    def intern(value):
+        value = func(value)
+        return setdefault(value, value)
+    return intern
+
+
+_IDENTIFIER = re.compile('^[A-Za-z_][A-Za-z0-9_]*$')
+
+# Characters that make the split parser hand a line to the regex:
+# backslashes (escaped quotes) and whitespace that \S would reject.
+_SPLIT_FALLBACK = '\\\t\n\r\f\v'
+
+
+def _split_parser(kinds, captures, binary=False):
+    """
+    Generates a function that parses a stripped line by splitting it
+    on quotes and then on spaces, returning the captured values like
+    match.groups() or None if the regex has to decide.
+
+    kinds holds 'quoted', 'plain' or 'bracket' for each format
+    element.  Returns None for formats the split parser can't handle.
+    """
+    if 'url' in kinds:
+        return None
+    segments = [[]]  # unquoted elements between the quoted ones
+    quoted = []
+    for i, kind in enumerate(kinds):
+        if kind == 'quoted':
+            quoted.append(i)
+            segments.append([])
+        else:
+            segments[-1].append(i)
+    code = ['def split_parse(line):']
+    if binary or str is bytes:
+        code.extend([
+            '    try:',
+            '        if len(line.translate(None, _FALLBACK)) != len(line):',
+            '            return None',
+            '    except TypeError:  # unicode line',
+            '        return None',
+            ])
+    else:
+        code.extend([
+            '    if %s:' % ' or '.join(
+                    '%r in line' % c for c in _SPLIT_FALLBACK),
+            '        return None',
+            ])
+    code.extend([
+        '    parts = line.split(_Q)',
+        '    if len(parts) != %d:' % (2 * len(quoted) + 1),
+        '        return None',
+        ])
+    values = {}
+    for n, i in enumerate(quoted):
+        values[i] = 'parts[%d]' % (2 * n + 1)
+    for n, segment in enumerate(segments):
+        part = 'parts[%d]' % (2 * n)
+        lead = int(n > 0)  # the segment follows a quoted element
+        trail = int(n < len(segments) - 1)  # and precedes one
+        t = 't%d' % n
+        if not segment:
+            code.extend([
+                '    if %s != %s:' % (part, '_SP' if lead and trail else '_E'),
+                '        return None',
+                ])
+            continue
+        brackets = [j for j,i in enumerate(segment) if kinds[i] == 'bracket']
+        if len(brackets) > 1:
+            return None
+        if not brackets:
+            checks = ['len(%s) != %d' % (t, len(segment) + lead + trail)]
+            if lead:
+                checks.append('%s[0]' % t)
+            if trail:
+                checks.append('%s[-1]' % t)
+            code.extend([
+                '    %s = %s.split(_SP)' % (t, part),
+                '    if %s:' % ' or '.join(checks),
+                '        return None',
+                ])
+            for j,i in enumerate(segment):
+                values[i] = '%s[%d]' % (t, j + lead)
+            continue
+        b = brackets[0]
+        after = len(segment) - b - 1
+        r = 'r%d' % n
+        checks = ['len(%s) != %d' % (t, b + lead + 1)]
+        if lead:
+            checks.append('%s[0]' % t)
+        code.extend([
+            '    %s = %s.split(_SP, %d)' % (t, part, b + lead),
+            '    if %s:' % ' or '.join(checks),
+            '        return None',
+            '    %s = %s[%d]' % (r, t, b + lead),
+            '    j%d = %s.find(_RB)' % (n, r),
+            '    if j%d < 2 or %s[:1] != _LB:' % (n, r),
+            '        return None',
+            ])
+        if after:
+            a = 'a%d' % n
+            checks = ['len(%s) != %d' % (a, after + 1 + trail), '%s[0]' % a]
+            if trail:
+                checks.append('%s[-1]' % a)
+            code.extend([
+                '    %s = %s[j%d + 1:].split(_SP)' % (a, r, n),
+                '    if %s:' % ' or '.join(checks),
+                '        return None',
+                ])
+        else:
+            code.extend([
+                '    if %s[j%d + 1:] != %s:' % (r, n, '_SP' if trail else '_E'),
+                '        return None',
+                ])
+        for j,i in enumerate(segment):
+            if j < b:
+                values[i] = '%s[%d]' % (t, j + lead)
+            elif j == b:
+                values[i] = '%s[:j%d + 1]' % (r, n)
+            else:
+                values[i] = 'a%d[%d]' % (n, j - b)
+    captured = [values[i] for i in range(len(kinds)) if captures[i]]
+    code.append('    return (%s)' % ''.join(v + ', ' for v in captured))
+    namespace = {
+        '_Q': '"', '_SP': ' ', '_E': '', '_LB': '[', '_RB': ']',
+        '_FALLBACK': _SPLIT_FALLBACK,
+        }
+    if binary:
+        namespace = dict(
+            (k, v.encode('ascii')) for k,v in namespace.items())
+    exec('\n'.join(code), namespace)
+    return namespace['split_parse']
+
+
 class Parser (object):
+    # Policies for unparsable lines in parse_iter and parse_many.
+    ERRORS = ('raise', 'skip', 'collect')
+
     format_to_name = {
         # Explanatory comments copied from
         # http://httpd.apache.org/docs/2.2/mod/mod_log_config.html
@@ -136,7 +460,9 @@ class Parser (object):
         '%O':'bytes_sent',
     }
 
-    def __init__(self, format, use_friendly_names=False):
+    def __init__(self, format, use_friendly_names=False, binary=False,
+                 fields=None, fast=False, converters=None, interned=None,
+                 compact=False):
         """
         Takes the log format from an Apache configuration file.
 
@@ -145,11 +471,61 @@ class Parser (object):
 
         format = r'%h %l %u %t \"%r\" %>s %b \"%{Referer}i\" \"%{User-Agent}i\"'
         p = apachelog.parser(format)
+
+        With binary=True the parser matches undecoded bytes lines
+        (e.g. from apachelog.file.open(filename, binary=True)) and
+        returns BytesAttrDict records holding bytes values, so fields
+        that are never looked at are never decoded.
+
+        If you only need some of the fields, list them (as format
+        directives or friendly names) in fields.  The other
+        directives are matched without being captured, and any run
+        of them at the end of the format is skipped entirely (so
+        those trailing fields are not validated).
+
+        With fast=True, lines are first split on quotes and spaces
+        by a function generated for the format instead of matched
+        with the regular expression.  CPython's regular expression
+        engine is usually at least as fast on typical formats, so
+        this is off by default; measure on your own logs before
+        enabling it.  Lines that function can't handle (e.g. with
+        escaped quotes) and formats with %U fall back to the regular
+        expression.  Pass fast='verify' to run both on every line and
+        raise an exception if they ever disagree.
+
+        converters maps format directives to functions applied to
+        their values as each line is parsed; pass True to use
+        CONVERTERS, which turns the numeric fields into ints and
+        floats and %t into epoch seconds.  Lines with values that
+        can't be converted are treated like unparsable lines.  When
+        converting, the values of the interned directives (INTERNED
+        by default) are shared between records, so a few distinct
+        status codes or methods don't cost an object per line.
+
+        With compact=True, records are instances of a Record
+        subclass generated for the format (see record_class) rather
+        than dictionaries; in binary mode they are BytesRecords, with
+        the same text method as BytesAttrDict.
         """
+        self._args = (format, use_friendly_names, binary, fields, fast,
+                      converters, interned, compact)
         self._names = []
         self._regex = None
         self._pattern = ''
         self._use_friendly_names = use_friendly_names
+        self._binary = binary
+        self._fields = fields
+        self._fast_mode = fast
+        self._fast = None
+        self._record = BytesAttrDict if binary else AttrDict
+        if converters is True:
+            converters = CONVERTERS
+        if interned is None and converters is not None:
+            interned = INTERNED
+        self._converters = converters
+        self._interned = interned or ()
+        self._convert = None
+        self._compact = compact
         self._parse_format(format)
 
     def _parse_format(self, format):
@@ -171,6 +547,16 @@ class Parser (object):
         lstripquotes = re.compile(r'^\\"')
         rstripquotes = re.compile(r'\\"$')
         self._names = []
+        self._aliases = []
+        self._elements = []
+        self._directives = []
+        kinds = []
+        captures = []
+        wanted = missing = None
+        if self._fields is not None:
+            wanted = set(self._fields)
+            missing = set(self._fields)
+        last_wanted = -1
 
         for element in format.split(' '):
 
@@ -182,32 +568,128 @@ class Parser (object):
                 element = rstripquotes.sub('', element)
 
             if self._use_friendly_names:
-                self._names.append(self.alias(element))
+                name = self.alias(element)
             else:
-                self._names.append(element)
+                name = element
+            self._elements.append(element)
+
+            capture = wanted is None or element in wanted or name in wanted
+            if capture:
+                self._names.append(name)
+                self._aliases.append(self.alias(element))
+                self._directives.append(element)
+                last_wanted = len(self._elements) - 1
+                if missing:
+                    missing.discard(element)
+                    missing.discard(name)
+                group = '(%s)'
+            else:
+                group = '%s'
 
-            subpattern = '(\S*)'
+            subpattern = group % r'\S*'
+            kind = 'plain'
 
             if hasquotes:
                 if element == '%r' or findreferreragent.search(element):
-                    subpattern = r'\"([^"\\]*(?:\\.[^"\\]*)*)\"'
+                    subpattern = (
+                        r'\"' + group % r'[^"\\]*(?:\\.[^"\\]*)*' + r'\"')
                 else:
-                    subpattern = r'\"([^\"]*)\"'
+                    subpattern = r'\"' + group % r'[^\"]*' + r'\"'
+                kind = 'quoted'
 
             elif findpercent.search(element):
-                subpattern = r'(\[[^\]]+\])'
+                subpattern = group % r'\[[^\]]+\]'
+                kind = 'bracket'
 
             elif element == '%U':
-                subpattern = '(.+?)'
+                subpattern = group % '.+?'
+                kind = 'url'
 
+            if '"' in element:
+                kind = 'url'  # not something the split parser can handle
             subpatterns.append(subpattern)
-
+            kinds.append(kind)
+            captures.append(capture)
+
+        if missing:
+            raise ApacheLogParserError(
+                'fields not in the log format: %s' % ', '.join(sorted(missing)))
+        if last_wanted < len(subpatterns) - 1:
+            # nothing is captured after last_wanted, so skip the rest
+            subpatterns = subpatterns[:last_wanted + 1]
+            subpatterns.append('.*')
         self._pattern = '^' + ' '.join(subpatterns) + '$'
+        pattern = self._pattern
+        if self._binary and not isinstance(pattern, bytes):
+            pattern = pattern.encode('ascii')
         try:
-            self._regex = re.compile(self._pattern)
+            self._regex = re.compile(pattern)
         except Exception, e:
             raise ApacheLogParserError(e)
 
+        self._convert = self._converter(self._converters)
+        if self._compact:
+            self._record = record_class(
+                self._names, [self._aliases, self._directives],
+                base=BytesRecord if self._binary else Record)
+
+        self._fast = None
+        if self._fast_mode:
+            self._fast = _split_parser(kinds, captures, self._binary)
+        if self._fast is not None and self._fast_mode == 'verify':
+            self._fast = self._verified(self._fast)
+
+    def __reduce__(self):
+        """
+        Pickles the parser by its arguments, since the compiled
+        pattern and generated functions can't be pickled.
+        """
+        return (self.__class__, self._args)
+
+    def _converter(self, converters):
+        """
+        Builds the function applying converters (and interning) to
+        the captured values, or returns None if there is nothing to
+        do.
+        """
+        funcs = []
+        for i, directive in enumerate(self._directives):
+            func = None
+            if converters is not None:
+                func = converters.get(directive)
+            if directive in self._interned:
+                func = _interner(func)
+            if func is not None:
+                funcs.append((i, func))
+        if not funcs:
+            return None
+        def convert(groups):
+            groups = list(groups)
+            try:
+                for i, func in funcs:
+                    groups[i] = func(groups[i])
+            except (ValueError, KeyError, IndexError):
+                return None
+            return groups
+        return convert
+
+    def _verified(self, fast):
+        """
+        Wraps a split parser so each line it accepts is checked
+        against the regular expression.
+        """
+        match = self._regex.match
+        def verified(line):
+            groups = fast(line)
+            if groups is not None:
+                m = match(line)
+                if m is None or m.groups() != groups:
+                    raise ApacheLogParserError(
+                        "Split parser gave %r instead of %r for: %s" % (
+                            groups, m and m.groups(), line))
+            return groups
+        return verified
+
     def parse(self, line):
         """
         Parses a single line from the log file and returns
@@ -216,15 +698,147 @@ class Parser (object):
         Raises and exception if it couldn't parse the line
         """
         line = line.strip()
-        match = self._regex.match(line)
+        groups = None
+        if self._fast is not None:
+            groups = self._fast(line)
+        if groups is None:
+            match = self._regex.match(line)
+            if match:
+                groups = match.groups()
+        if groups is not None and self._convert is not None:
+            groups = self._convert(groups)
+
+        if groups is not None:
+            if self._compact:
+                return self._record(groups)
+            return self._record(zip(self._names, groups))
+
+        raise self._error(line)
+
+    def parse_iter(self, stream, errors='raise', bad_lines=None):
+        """
+        Parses each line from an iterable (e.g. an open log file)
+        and yields a dictionary for each of them.
+
+        This gives the same records as calling parse on every line,
+        but the per-line attribute lookups are hoisted out of the
+        loop, so it is the faster way to work through a whole file.
+
+        errors selects what happens to lines that can't be parsed:
+        'raise' (the default) raises an exception like parse does,
+        'skip' silently drops them, and 'collect' drops them after
+        appending them to the bad_lines list.
+        """
+        names = self._names
+        record = self._record
+        groups = self._iter_groups(stream, errors, bad_lines, self._convert)
+        if self._compact:
+            return _itertools.imap(record, groups)
+        return (record(zip(names, g)) for g in groups)
+
+    def parse_columns(self, stream, batch_size=10000, errors='raise',
+                      bad_lines=None, numpy=False, raw=()):
+        """
+        Parses the lines from an iterable in batches of batch_size
+        lines, and yields an apachelog.column.Batch holding one
+        column per field for each batch.
+
+        The numeric directives listed in column.TYPECODES are
+        converted with CONVERTERS (unless this parser has its own
+        converters for them) and stored in array.array columns, or
+        NumPy arrays with numpy=True.  The other fields are stored in
+        dictionary-encoded column.EncodedColumn objects.
+
+        The converted directives listed in raw also keep their
+        unconverted values, in EncodedColumns returned by Batch.raw.
 
-        if match:
-            data = AttrDict()
-            for k, v in zip(self._names, match.groups()):
-                data[k] = v
-            return data
+        See parse_iter for the errors and bad_lines arguments.
+        """
+        converters = dict(self._converters or {})
+        builders = []
+        for directive in self._directives:
+            typecode = _column.TYPECODES.get(directive)
+            builders.append(typecode)
+            if typecode is not None and directive not in converters:
+                converters[directive] = CONVERTERS[directive]
+        convert = self._converter(converters)
+        names = self._names
+        keep = [i for i,(name,directive) in enumerate(
+                zip(names, self._directives))
+                if name in raw and directive in converters]
+        if keep:
+            def convert_keeping_raw(groups):
+                converted = convert(groups)
+                if converted is None:
+                    return None
+                return (converted, groups)
+            groups = self._iter_groups(
+                stream, errors, bad_lines, convert_keeping_raw)
+        else:
+            groups = self._iter_groups(stream, errors, bad_lines, convert)
+        while True:
+            rows = list(_itertools.islice(groups, batch_size))
+            if not rows:
+                return
+            raw_columns = {}
+            if keep:
+                raw_rows = [row[1] for row in rows]
+                rows = [row[0] for row in rows]
+                for i in keep:
+                    raw_columns[names[i]] = _column.encoded_column(
+                        [row[i] for row in raw_rows], numpy)
+            columns = {}
+            for name,typecode,items in zip(names, builders, zip(*rows)):
+                if typecode is None:
+                    columns[name] = _column.encoded_column(items, numpy)
+                else:
+                    columns[name] = _column.numeric_column(
+                        typecode, items, numpy)
+            yield _column.Batch(
+                columns=columns, names=names, raw_columns=raw_columns)
 
-        raise ApacheLogParserError("Unable to parse: %s with the %s regular expression" % ( line, self._pattern ) )
+    def _iter_groups(self, stream, errors, bad_lines, convert):
+        """
+        Does the work for parse_iter and parse_columns, yielding the
+        captured values for each line after applying convert.
+        """
+        if errors not in self.ERRORS:
+            raise ValueError('unknown errors policy: %r' % (errors,))
+        if errors == 'collect' and bad_lines is None:
+            raise ValueError("the 'collect' policy needs a bad_lines list")
+        fast = self._fast
+        match = self._regex.match
+        for line in stream:
+            stripped = line.strip()
+            groups = None
+            if fast is not None:
+                groups = fast(stripped)
+            if groups is None:
+                m = match(stripped)
+                if m is not None:
+                    groups = m.groups()
+            if groups is not None and convert is not None:
+                groups = convert(groups)
+            if groups is None:
+                if errors == 'raise':
+                    raise self._error(stripped)
+                if errors == 'collect':
+                    bad_lines.append(line)
+                continue
+            yield groups
+
+    def parse_many(self, lines, errors='raise', bad_lines=None):
+        """
+        Parses a sequence of lines and returns a list of dictionaries.
+
+        See parse_iter for the errors and bad_lines arguments.
+        """
+        return list(self.parse_iter(lines, errors, bad_lines))
+
+    def _error(self, line):
+        return ApacheLogParserError(
+            "Unable to parse: %s with the %s regular expression" % (
+                line, self._pattern))
 
     def alias(self, name):
         """
@@ -256,6 +870,13 @@ class Parser (object):
         except KeyError:
             return name
 
+    def record_class(self):
+        """
+        Returns the Record subclass used for compact records (or
+        the dictionary class used otherwise)
+        """
+        return self._record
+
     def pattern(self):
         """
         Returns the compound regular expression the parser extracted
@@ -1,17 +1,258 @@
 """Define ``Processor`` classes for aggregating data across log files.
 """
 
+from ..date import cached_parse_epoch_offset as _parse_epoch_offset
+
+
+def _time(data):
+    time = data['%t']
+    if isinstance(time, (int, long)):  # already converted by the parser
+        return (time, '+0000')
+    return _parse_epoch_offset(time)
+
+
+def _bytes(data):
+    b = data['%b']
+    if isinstance(b, (int, long)):
+        return b
+    try:
+        return int(b)  # excludes HTTP headers
+    except ValueError:  # '-'
+        return None
+
+
+"""Values computed from each record for the processors that need them
+
+Each entry maps a name to a function of the record.  ``time`` is an
+``(epoch, offset)`` tuple, and ``bytes`` is the response size
+(``None`` for ``-``).
+"""
+DERIVED = {
+    'time': _time,
+    'bytes': _bytes,
+    }
+
+
+class Derived (object):
+    "The ``DERIVED`` values for the current record (see ``Pipeline``)."
+    __slots__ = tuple(sorted(DERIVED))
+
+
 class Processor (object):
+    r"""Base class for log processors.
+
+    Processors that support it can be combined, so separate parts of
+    the logs may be processed independently (in worker processes, or
+    on different hosts) and the partial results summed afterwards.
+    Processors pickle to a compact state for shipping around.
+
+    >>> import pickle
+    >>> import StringIO
+    >>> from apachelog.parser import Parser, FORMATS
+    >>> from apachelog.processor.bandwidth import IPBandwidthProcessor
+    >>> parser = Parser(FORMATS['extended'])
+    >>> a = IPBandwidthProcessor()
+    >>> b = a.spawn()
+    >>> process(StringIO.StringIO(
+    ...     '192.168.0.1 - - [18/Feb/2012:10:25:43 -0500] "GET / HTTP/1.1" 200 560 "-" "-"'),
+    ...     parser, [a])
+    >>> process(StringIO.StringIO(
+    ...     '192.168.0.2 - - [18/Feb/2012:10:25:58 -0500] "GET / HTTP/1.1" 200 8240 "-" "-"'),
+    ...     parser, [b])
+    >>> a += pickle.loads(pickle.dumps(b, pickle.HIGHEST_PROTOCOL))
+    >>> sorted(a.ip_bytes.items())
+    [('192.168.0.1', 560), ('192.168.0.2', 8240)]
+    >>> a.total_seconds()
+    15.0
+
+    Only processors of the same type may be combined.
+
+    >>> from apachelog.processor.status import StatusProcessor
+    >>> a.merge(StatusProcessor())
+    Traceback (most recent call last):
+      ...
+    TypeError: cannot merge StatusProcessor into IPBandwidthProcessor
+    """
+    # The format directives ``process`` reads from each record, or
+    # ``None`` if it may read any of them.
+    fields = None
+
+    # The ``DERIVED`` values ``process_derived`` uses.
+    derived = ()
+
+    # The converted fields ``process_batch`` reads unconverted, with
+    # ``batch.raw`` (see ``process_columns``).
+    raw_fields = ()
+
+    # Attributes that only describe the most recent record.  They are
+    # not pickled, and are ``None`` after unpickling or merging.
+    _transient = ()
+
     def process(self, data):
         pass
 
+    def process_derived(self, data, derived):
+        """Process a record, with its ``derived`` values (see ``Pipeline``).
+
+        ``derived`` has an attribute for each name in the processor's
+        ``derived`` list.  It is reused for the next record, so don't
+        keep it.  By default this calls ``process``.  ``Pipeline`` only
+        uses it if no subclass overrides ``process`` without also
+        overriding ``process_derived``.
+        """
+        self.process(data)
+
+    def spawn(self):
+        """Return a new, empty processor configured like this one.
+
+        Processors whose constructors take arguments should override
+        this.
+        """
+        return self.__class__()
+
+    def merge(self, other):
+        """Add the results of ``other`` (from ``spawn``) to this processor.
+
+        Subclasses that support merging override this, calling
+        ``_check_merge`` first.
+        """
+        raise NotImplementedError(
+            '{} cannot merge results'.format(type(self).__name__))
+
+    def _check_merge(self, other):
+        if not isinstance(other, type(self)):
+            raise TypeError('cannot merge {} into {}'.format(
+                    type(other).__name__, type(self).__name__))
+        for name in self._transient:
+            setattr(self, name, None)
+
+    def __iadd__(self, other):
+        self.merge(other)
+        return self
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for name in self._transient:
+            state.pop(name, None)
+        return state
 
-def process(stream, parser, processors):
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        for name in self._transient:
+            setattr(self, name, None)
+
+    def process_batch(self, batch):
+        """Process an ``apachelog.column.Batch``.
+
+        Processors that can aggregate whole columns at once override
+        this.  By default, each line is passed to ``process`` in turn.
+        """
+        for data in batch.records():
+            self.process(data)
+
+
+def required_fields(processors):
+    """Return the directives needed by a list of processors.
+
+    The result is suitable for the ``fields`` argument of
+    ``apachelog.parser.Parser``.  It is ``None`` (meaning all fields)
+    if any processor does not declare its ``fields``.
+
+    >>> from apachelog.processor.bandwidth import BandwidthProcessor
+    >>> from apachelog.processor.status import StatusProcessor
+    >>> sorted(required_fields([BandwidthProcessor(), StatusProcessor()]))
+    ['%>s', '%b', '%r', '%t']
+    >>> print(required_fields([BandwidthProcessor(), Processor()]))
+    None
+    """
+    fields = []
+    for processor in processors:
+        if processor.fields is None:
+            return None
+        fields.extend(processor.fields)
+    return frozenset(fields)
+
+
+class Pipeline (object):
+    """Feed records to a list of processors.
+
+    Each ``DERIVED`` value that any of the processors needs is
+    computed once per record and shared between them.  Processors
+    whose ``process`` is overridden by a subclass (without a matching
+    ``process_derived``) get plain ``process`` calls.
+
+    >>> from apachelog.parser import Parser, FORMATS
+    >>> from apachelog.processor.bandwidth import BandwidthProcessor
+    >>> from apachelog.processor.bandwidth import IPBandwidthProcessor
+    >>> parser = Parser(FORMATS['extended'])
+    >>> pipeline = Pipeline([BandwidthProcessor(), IPBandwidthProcessor()])
+    >>> pipeline.derived
+    ('time', 'bytes')
+    >>> pipeline.process(parser.parse(
+    ...     '192.168.0.1 - - [18/Feb/2012:10:25:43 -0500] "GET / HTTP/1.1" 200 560 "-" "-"'))
+    >>> [p.bytes for p in pipeline.processors]
+    [560, 560]
+
+    >>> class CountingProcessor (BandwidthProcessor):
+    ...     lines = 0
+    ...     def process(self, data):
+    ...         self.lines += 1
+    ...         super(CountingProcessor, self).process(data)
+    >>> pipeline = Pipeline([CountingProcessor()])
+    >>> pipeline.derived
+    ()
+    >>> pipeline.process(parser.parse(
+    ...     '192.168.0.1 - - [18/Feb/2012:10:25:43 -0500] "GET / HTTP/1.1" 200 560 "-" "-"'))
+    >>> [(p.lines, p.bytes) for p in pipeline.processors]
+    [(1, 560)]
+    """
+    def __init__(self, processors):
+        self.processors = list(processors)
+        derived = []
+        self._methods = []
+        for processor in self.processors:
+            if not self._uses_derived(processor):
+                self._methods.append(self._plain(processor.process))
+                continue
+            self._methods.append(processor.process_derived)
+            for name in processor.derived:
+                if name not in derived:
+                    derived.append(name)
+        self.derived = tuple(derived)
+        self._derivers = [(name, DERIVED[name]) for name in derived]
+        self._values = Derived()
+
+    @staticmethod
+    def _uses_derived(processor):
+        "Is ``process_derived`` at least as specific as ``process``?"
+        mro = type(processor).__mro__
+        def definer(name):
+            for i,cls in enumerate(mro):
+                if name in cls.__dict__:
+                    return i
+        return definer('process_derived') <= definer('process')
+
+    @staticmethod
+    def _plain(process):
+        def method(data, derived):
+            process(data)
+        return method
+
+    def process(self, data):
+        values = self._values
+        for name,derive in self._derivers:
+            setattr(values, name, derive(data))
+        for method in self._methods:
+            method(data, values)
+
+
+def process(stream, parser, processors, errors='raise', bad_lines=None):
     r"""Process a log with a list of processors.
 
     For each line in the log located at ``filename``, parse the line
     using ``parser`` and analyze it with each of the ``Processor``
-    instances in the list ``processors``.
+    instances in the list ``processors`` (through a ``Pipeline``).
+    ``errors`` and ``bad_lines`` are passed to ``Parser.parse_iter``.
 
     >>> import StringIO
     >>> from apachelog.parser import Parser, FORMATS
@@ -32,7 +273,43 @@ def process(stream, parser, processors):
     a: 192.168.0.2
     b: 192.168.0.2
     """
-    for line in stream:
-        data = parser.parse(line)
-        for processor in processors:
-            processor.process(data)
+    process = Pipeline(processors).process
+    for data in parser.parse_iter(stream, errors, bad_lines):
+        process(data)
+
+
+def process_columns(stream, parser, processors, batch_size=10000,
+                    numpy=False):
+    r"""Process a log in columnar batches with a list of processors.
+
+    Like ``process``, but the log is parsed with
+    ``parser.parse_columns`` and each batch is handed to the
+    processors' ``process_batch`` methods.  Note that the numeric
+    fields in a batch have been converted (see
+    ``apachelog.column.TYPECODES``), unless a processor lists them in
+    its ``raw_fields``, in which case ``batch.raw`` also has the
+    unconverted values.
+
+    >>> import StringIO
+    >>> from apachelog.parser import Parser, FORMATS
+    >>> from apachelog.processor.bandwidth import IPBandwidthProcessor
+    >>> stream = StringIO.StringIO('\n'.join([
+    ...         '192.168.0.1 - - [18/Feb/2012:10:25:43 -0500] "GET / HTTP/1.1" 200 560 "-" "Mozilla/5.0 (...)"',
+    ...         '192.168.0.1 - - [18/Feb/2012:10:25:43 -0500] "GET /style.css HTTP/1.1" 200 8240 "-" "Mozilla/5.0 (...)"',
+    ...         '192.168.0.2 - - [18/Feb/2012:10:25:58 -0500] "GET / HTTP/1.1" 200 560 "-" "Mozilla/5.0 (...)"',
+    ...         ]))
+    >>> parser = Parser(FORMATS['extended'])
+    >>> bwp = IPBandwidthProcessor()
+    >>> process_columns(stream, parser, [bwp], batch_size=2)
+    >>> sorted(bwp.ip_bytes.items())
+    [('192.168.0.1', 8800), ('192.168.0.2', 560)]
+    >>> bwp.total_seconds()
+    15.0
+    """
+    methods = [processor.process_batch for processor in processors]
+    raw = frozenset(
+        name for processor in processors for name in processor.raw_fields)
+    for batch in parser.parse_columns(
+            stream, batch_size=batch_size, numpy=numpy, raw=raw):
+        for method in methods:
+            method(batch)
@@ -2,6 +2,10 @@ from __future__ import division
 
 import datetime as _datetime
 
+from ..column import group_totals as _group_totals
+from ..column import total as _total
+from ..sketch import SpaceSaving as _SpaceSaving
+from . import DERIVED as _DERIVED
 from .time import LogTimeProcessor as _LogTimeProcessor
 
 
@@ -27,6 +31,9 @@ class BandwidthProcessor (_LogTimeProcessor):
         'MB/s': 1e-6,
         'MB/month': 1e-6*_datetime.timedelta(days=30).total_seconds(),
         }
+    fields = ('%t', '%b')
+    derived = ('time', 'bytes')
+    _transient = _LogTimeProcessor._transient + ('last_bytes',)
 
     def __init__(self, **kwargs):
         super(BandwidthProcessor, self).__init__(**kwargs)
@@ -35,12 +42,25 @@ class BandwidthProcessor (_LogTimeProcessor):
 
     def process(self, data):
         super(BandwidthProcessor, self).process(data)
-        self.last_bytes = None  # for use by subclasses
-        try:
-            self.last_bytes = int(data['%b'])  # excludes HTTP headers
-        except ValueError:
-            return
-        self.bytes += self.last_bytes
+        self._process_bytes(_DERIVED['bytes'](data))
+
+    def process_derived(self, data, derived):
+        super(BandwidthProcessor, self).process_derived(data, derived)
+        self._process_bytes(derived.bytes)
+
+    def _process_bytes(self, b):
+        self.last_bytes = b  # for use by subclasses
+        if b is not None:
+            self.bytes += b
+
+    def process_batch(self, batch):
+        super(BandwidthProcessor, self).process_batch(batch)
+        self.last_bytes = None
+        self.bytes += _total(batch['%b'])
+
+    def merge(self, other):
+        super(BandwidthProcessor, self).merge(other)
+        self.bytes += other.bytes
 
     def bandwidth(self, scale='kB/s', _bytes=None):
         """
@@ -104,34 +124,143 @@ class IPBandwidthProcessor (BandwidthProcessor):
     ...         scale='MB/month', sort_by_bandwidth=True):
     ...     print('\t'.join([ip, str(bw)]))  # doctest: +NORMALIZE_WHITESPACE
     testbot     1617.408
+
+    With ``capacity`` set, only that many IPs are tracked (see
+    ``apachelog.sketch.SpaceSaving``), so memory stays bounded however
+    many clients there are.  The totals in ``ip_bytes`` are then upper
+    bounds, each too high by at most ``ip_error``, and every client
+    that sent more than ``bytes / capacity`` is tracked.
+
+    >>> stream.seek(0)
+    >>> bwp = IPBandwidthProcessor(capacity=1)
+    >>> process(stream, parser, [bwp])
+    >>> sorted(bwp.ip_bytes.items())
+    [('192.168.0.2', 9360)]
+    >>> bwp.ip_error('192.168.0.2')
+    8800
     """
-    def __init__(self, **kwargs):
+    fields = ('%t', '%b', '%h')
+
+    def __init__(self, capacity=None, **kwargs):
         super(IPBandwidthProcessor, self).__init__(**kwargs)
-        self.ip_bytes = {}
+        self.capacity = capacity
+        if capacity is None:
+            self.top_ips = None
+            self.ip_bytes = {}
+        else:
+            self.top_ips = _SpaceSaving(size=capacity)
+            self.ip_bytes = self.top_ips.counts
 
     def process(self, data):
         super(IPBandwidthProcessor, self).process(data)
+        self._process_ip(data)
+
+    def process_derived(self, data, derived):
+        super(IPBandwidthProcessor, self).process_derived(data, derived)
+        self._process_ip(data)
+
+    def _process_ip(self, data):
         if self.last_bytes:
             ip = data['%h']
-            self.ip_bytes[ip] = self.last_bytes + self.ip_bytes.get(ip, 0)
+            if self.top_ips is None:
+                self.ip_bytes[ip] = self.last_bytes + self.ip_bytes.get(ip, 0)
+            else:
+                self.top_ips.add(ip, self.last_bytes)
+
+    def process_batch(self, batch):
+        super(IPBandwidthProcessor, self).process_batch(batch)
+        hosts = batch['%h']
+        for code,b in _group_totals(hosts.codes, batch['%b']):
+            if b:
+                ip = hosts.values[code]
+                if self.top_ips is None:
+                    self.ip_bytes[ip] = b + self.ip_bytes.get(ip, 0)
+                else:
+                    self.top_ips.add(ip, b)
+
+    def spawn(self):
+        return self.__class__(capacity=self.capacity)
+
+    def merge(self, other):
+        self._check_merge(other)
+        if self.top_ips is None and other.top_ips is not None:
+            raise ValueError(
+                'cannot merge capacity {} into an unlimited {}'.format(
+                    other.capacity, type(self).__name__))
+        super(IPBandwidthProcessor, self).merge(other)
+        if self.top_ips is None:
+            for ip,b in other.ip_bytes.items():
+                self.ip_bytes[ip] = b + self.ip_bytes.get(ip, 0)
+        elif other.top_ips is None:
+            for ip,b in other.ip_bytes.items():
+                self.top_ips.add(ip, b)
+        else:
+            self.top_ips.merge(other.top_ips)
+
+    def ip_error(self, ip):
+        """Return how much ``ip_bytes[ip]`` may overestimate by.
+
+        Always zero without a ``capacity``.
+        """
+        if self.top_ips is None:
+            return 0
+        if ip in self.top_ips.errors:
+            return self.top_ips.errors[ip]
+        return self.top_ips.minimum()
+
+    def max_ip_error(self):
+        "Return a bound on the overestimates in ``ip_bytes``."
+        if self.top_ips is None:
+            return 0
+        return self.top_ips.max_error()
+
+    def _rename_ip(self, ip, name):
+        if self.top_ips is None:
+            b = self.ip_bytes.pop(ip)
+            self.ip_bytes[name] = b + self.ip_bytes.get(name, 0)
+        else:
+            self.top_ips.rename(ip, name)
 
     def resolve(self, resolver, top=None, minimum_total=None):
+        """Consolidate ``ip_bytes`` entries by resolved name.
+
+        The candidate IPs are looked up in batches with the resolver's
+        ``resolve_many``, so slow lookups overlap.
+        """
         resolved = set()
         remaining = self.bytes
+        target_rem = None
         if minimum_total is not None:
             target_rem = minimum_total*self.bytes
         ip_bw = self.ip_bandwidth(sort_by_bandwidth=True)
-        for ip,bw in reversed(ip_bw):
+        ips = [ip for ip,bw in reversed(ip_bw)]
+        for i,ip in enumerate(ips):
             if top is not None and len(resolved) > top:
                 break
-            if minimum_total is not None and remaining < target_rem:
+            if target_rem is not None and remaining < target_rem:
                 break
+            if ip not in resolver.IP:
+                resolver.resolve_many(self._resolve_candidates(
+                        ips=ips[i:], remaining=remaining,
+                        target_rem=target_rem,
+                        count=max(resolver.threads, (top or 0) + 1)))
             remaining -= self.ip_bytes[ip]
             rip = resolver.resolve(ip)
             resolved.add(rip)
             if rip != ip:
-                b = self.ip_bytes.pop(ip)
-                self.ip_bytes[rip] = b + self.ip_bytes.get(rip, 0)
+                self._rename_ip(ip, rip)
+
+    def _resolve_candidates(self, ips, remaining, target_rem, count):
+        "Return the next IPs that ``resolve`` will probably look up."
+        candidates = []
+        for ip in ips:
+            if len(candidates) >= count:
+                break
+            if target_rem is not None and remaining < target_rem:
+                break
+            candidates.append(ip)
+            remaining -= self.ip_bytes[ip]
+        return candidates
 
     def ip_bandwidth(self, sort_by_bandwidth=False, **kwargs):
         """Return a ``name`` -> ``bandwidth`` dictionary.
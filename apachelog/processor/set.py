@@ -1,4 +1,5 @@
 from . import Processor as _Processor
+from .. import sketch as _sketch
 
 
 class SetProcessor (_Processor):
@@ -7,23 +8,149 @@ class SetProcessor (_Processor):
     >>> import StringIO
     >>> from apachelog.parser import Parser, FORMATS
     >>> from apachelog.processor import process
-    >>> stream = StringIO.StringIO('\n'.join([
+    >>> lines = '\n'.join([
     ...         '192.168.0.1 - - [18/Feb/2012:10:25:43 -0500] "GET / HTTP/1.1" 200 560 "-" "Mozilla/5.0 (...)"',
     ...         '192.168.0.1 - - [18/Feb/2012:10:25:43 -0500] "GET /style.css HTTP/1.1" 200 8240 "-" "Mozilla/5.0 (...)"',
     ...         '192.168.0.2 - - [18/Feb/2012:10:25:58 -0500] "GET / HTTP/1.1" 404 560 "-" "Mozilla/5.0 (...)"',
-    ...         ]))
+    ...         ])
     >>> parser = Parser(FORMATS['extended'])
     >>> sp = SetProcessor(keys=['%h', '%{User-Agent}i'])
-    >>> process(stream, parser, [sp])
+    >>> process(StringIO.StringIO(lines), parser, [sp])
     >>> for key,values in sorted(sp.values.items()):
     ...     print('\t'.join([key, str(values)]))
     ... # doctest: +NORMALIZE_WHITESPACE
     %h  set(['192.168.0.2', '192.168.0.1'])
     %{User-Agent}i      set(['Mozilla/5.0 (...)'])
+    >>> sp.count('%h')
+    (2, 0)
+
+    Columnar batches give the same values, including for fields the
+    parser converts to numbers.
+
+    >>> from apachelog.processor import process_columns
+    >>> keys = ['%h', '%>s', '%t', '%b']
+    >>> sp2 = SetProcessor(keys=keys)
+    >>> process_columns(StringIO.StringIO(lines + '\n' + lines.replace(
+    ...     ' 560 ', ' - ')), parser, [sp2])
+    >>> sp3 = SetProcessor(keys=keys)
+    >>> process(StringIO.StringIO(lines + '\n' + lines.replace(
+    ...     ' 560 ', ' - ')), parser, [sp3])
+    >>> sp2.values == sp3.values
+    True
+    >>> sorted(sp2.values['%b'])
+    ['-', '560', '8240']
+    >>> sorted(sp2.values['%t'])
+    ['[18/Feb/2012:10:25:43 -0500]', '[18/Feb/2012:10:25:58 -0500]']
+
+    With ``approximate=True`` the values are not kept.  Instead each
+    key gets a fixed-size ``HyperLogLog`` sketch (see
+    ``apachelog.sketch``), and ``count`` returns the estimated number
+    of distinct values with its relative standard error.  Set
+    ``sample`` to also keep a random sample of up to that many values.
+
+    >>> sp = SetProcessor(keys=['%h'], approximate=True, sample=1)
+    >>> process(StringIO.StringIO(lines), parser, [sp])
+    >>> count,error = sp.count('%h')
+    >>> (count, round(error, 4))
+    (2, 0.0163)
+    >>> sp.sample('%h')
+    ['192.168.0.1']
+    >>> sp2 = SetProcessor(keys=['%>s'], approximate=True, sample=5)
+    >>> process_columns(StringIO.StringIO(lines), parser, [sp2])
+    >>> (sp2.count('%>s')[0], sp2.sample('%>s'))
+    (2, ['200', '404'])
     """
-    def __init__(self, keys):
-        self.values = dict((k, set()) for k in keys)
+    def __init__(self, keys, approximate=False, precision=12, sample=0):
+        self.fields = tuple(keys)
+        self.approximate = approximate
+        self.precision = precision
+        self.sample_size = sample
+        if approximate:
+            self.values = None
+            self.sketches = dict(
+                (k, _sketch.HyperLogLog(precision=precision)) for k in keys)
+            self.samples = dict(
+                (k, _sketch.BottomKSample(size=sample))
+                for k in keys if sample)
+        else:
+            self.values = dict((k, set()) for k in keys)
+
+    @property
+    def raw_fields(self):
+        return self.fields
 
     def process(self, data):
+        if self.approximate:
+            for k in self.fields:
+                self._add_approximate(k, [data[k]])
+            return
         for k in self.values.keys():
             self.values[k].add(data[k])
+
+    def _add_approximate(self, key, values):
+        hash64 = _sketch.hash64
+        add_hash = self.sketches[key].add_hash
+        sample = self.samples.get(key)
+        for value in values:
+            h = hash64(value)
+            add_hash(h)
+            if sample is not None:
+                sample.add_hash(h, value)
+
+    def count(self, key):
+        """Return ``(count, error)`` for the distinct values of ``key``.
+
+        ``error`` is the relative standard error of ``count``, which is
+        zero unless the processor is approximate.
+        """
+        if self.approximate:
+            sketch = self.sketches[key]
+            return (sketch.cardinality(), sketch.error())
+        return (len(self.values[key]), 0)
+
+    def sample(self, key):
+        """Return some of the values seen for ``key``, sorted.
+
+        Exact processors return every value.
+        """
+        if self.approximate:
+            if key not in self.samples:
+                return []
+            return self.samples[key].values()
+        return sorted(self.values[key])
+
+    def spawn(self):
+        return self.__class__(
+            keys=self.fields, approximate=self.approximate,
+            precision=self.precision, sample=self.sample_size)
+
+    def _config(self):
+        return (self.fields, self.approximate, self.precision,
+                self.sample_size)
+
+    def merge(self, other):
+        self._check_merge(other)
+        if other.fields != self.fields:
+            raise ValueError('cannot merge keys {} into {}'.format(
+                    other.fields, self.fields))
+        if other._config() != self._config():
+            raise ValueError(
+                'cannot merge approximate={}, precision={}, sample={} into '
+                'approximate={}, precision={}, sample={}'.format(
+                    *(other._config()[1:] + self._config()[1:])))
+        if self.approximate:
+            for k,sketch in other.sketches.items():
+                self.sketches[k].merge(sketch)
+            for k,sample in other.samples.items():
+                self.samples[k].merge(sample)
+            return
+        for k,values in other.values.items():
+            self.values[k].update(values)
+
+    def process_batch(self, batch):
+        if self.approximate:
+            for k in self.fields:
+                self._add_approximate(k, batch.raw(k).values)
+            return
+        for k,values in self.values.items():
+            values.update(batch.raw(k).values)
@@ -1,3 +1,4 @@
+from ..column import distinct_pairs as _distinct_pairs
 from . import Processor as _Processor
 
 
@@ -25,7 +26,26 @@ class StatusProcessor (_Processor):
     ... # doctest: +NORMALIZE_WHITESPACE
     200 GET / HTTP/1.1, GET /style.css HTTP/1.1
     404 GET / HTTP/1.1
+
+    Columnar batches give the same results.
+
+    >>> from apachelog.processor import process_columns
+    >>> stream.seek(0)
+    >>> sp2 = StatusProcessor()
+    >>> process_columns(stream, parser, [sp2])
+    >>> (sp2.request, sp2.status) == (sp.request, sp.status)
+    True
+
+    Pickles only store the ``request`` map.
+
+    >>> import pickle
+    >>> sp3 = pickle.loads(pickle.dumps(sp))
+    >>> (sp3.request, sp3.status) == (sp.request, sp.status)
+    True
     """
+    fields = ('%r', '%>s')
+    raw_fields = ('%>s',)
+
     def __init__(self):
         self.request = {}
         self.status = {}
@@ -41,3 +61,193 @@ class StatusProcessor (_Processor):
             self.status[status].add(request)
         else:
             self.status[status] = set([request])
+
+    def merge(self, other):
+        self._check_merge(other)
+        for request,status in other.request.items():
+            self.request.setdefault(request, set()).update(status)
+        for status,request in other.status.items():
+            self.status.setdefault(status, set()).update(request)
+
+    def process_batch(self, batch):
+        requests = batch['%r']
+        statuses = batch.raw('%>s')
+        for code,status in _distinct_pairs(requests.codes, statuses.codes):
+            request = requests.values[code]
+            status = statuses.values[status]
+            self.request.setdefault(request, set()).add(status)
+            self.status.setdefault(status, set()).add(request)
+
+    def __getstate__(self):
+        # ``status`` is the inverse of ``request``; rebuild it on load
+        state = super(StatusProcessor, self).__getstate__()
+        del state['status']
+        return state
+
+    def __setstate__(self, state):
+        super(StatusProcessor, self).__setstate__(state)
+        self.status = {}
+        for request,statuses in self.request.items():
+            for status in statuses:
+                self.status.setdefault(status, set()).add(request)
+
+
+class StatusCountProcessor (_Processor):
+    r"""Count requests by status.
+
+    Request lines and statuses are interned to integer ids, and
+    ``counts`` maps ``request_id << 16 | status_id`` to the number of
+    times that request got that status.  The per-request and
+    per-status views are built when you ask for them.
+
+    >>> import StringIO
+    >>> from apachelog.parser import Parser, FORMATS
+    >>> from apachelog.processor import process
+    >>> stream = StringIO.StringIO('\n'.join([
+    ...         '192.168.0.1 - - [18/Feb/2012:10:25:43 -0500] "GET / HTTP/1.1" 200 560 "-" "Mozilla/5.0 (...)"',
+    ...         '192.168.0.1 - - [18/Feb/2012:10:25:43 -0500] "GET /style.css HTTP/1.1" 200 8240 "-" "Mozilla/5.0 (...)"',
+    ...         '192.168.0.2 - - [18/Feb/2012:10:25:58 -0500] "GET / HTTP/1.1" 404 560 "-" "Mozilla/5.0 (...)"',
+    ...         '192.168.0.2 - - [18/Feb/2012:10:25:59 -0500] "GET / HTTP/1.1" 404 560 "-" "Mozilla/5.0 (...)"',
+    ...         ]))
+    >>> parser = Parser(FORMATS['extended'])
+    >>> scp = StatusCountProcessor()
+    >>> process(stream, parser, [scp])
+    >>> for request,counts in sorted(scp.request_counts().items()):
+    ...     print('\t'.join([request, str(sorted(counts.items()))]))
+    ... # doctest: +NORMALIZE_WHITESPACE
+    GET / HTTP/1.1              [('200', 1), ('404', 2)]
+    GET /style.css HTTP/1.1     [('200', 1)]
+    >>> for status,counts in sorted(scp.status_counts(top=1).items()):
+    ...     print('\t'.join([status, str(counts)]))
+    ... # doctest: +NORMALIZE_WHITESPACE
+    200 [('GET / HTTP/1.1', 1)]
+    404 [('GET / HTTP/1.1', 2)]
+
+    The ``request`` and ``status`` views match ``StatusProcessor``'s.
+
+    >>> stream.seek(0)
+    >>> sp = StatusProcessor()
+    >>> process(stream, parser, [sp])
+    >>> (scp.request, scp.status) == (sp.request, sp.status)
+    True
+
+    Columnar batches and merged processors give the same counts.
+
+    >>> from apachelog.processor import process_columns
+    >>> stream.seek(0)
+    >>> scp2 = StatusCountProcessor()
+    >>> process_columns(stream, parser, [scp2], batch_size=3)
+    >>> scp2.request_counts() == scp.request_counts()
+    True
+    >>> import pickle
+    >>> scp3 = StatusCountProcessor()
+    >>> scp3.merge(pickle.loads(pickle.dumps(scp2)))
+    >>> scp3.merge(scp)
+    >>> scp3.status_counts()['404']
+    [('GET / HTTP/1.1', 4)]
+    """
+    fields = ('%r', '%>s')
+    raw_fields = ('%>s',)
+    _STATUS_BITS = 16
+
+    def __init__(self):
+        self.requests = []  # request id -> request line
+        self.statuses = []  # status id -> status
+        self.counts = {}
+        self._request_ids = {}
+        self._status_ids = {}
+
+    def _request_id(self, request):
+        rid = self._request_ids.get(request)
+        if rid is None:
+            rid = self._request_ids[request] = len(self.requests)
+            self.requests.append(request)
+        return rid
+
+    def _status_id(self, status):
+        sid = self._status_ids.get(status)
+        if sid is None:
+            sid = len(self.statuses)
+            if sid >> self._STATUS_BITS:
+                raise ValueError('too many distinct statuses')
+            self._status_ids[status] = sid
+            self.statuses.append(status)
+        return sid
+
+    def process(self, data):
+        key = (self._request_id(data['%r']) << self._STATUS_BITS |
+               self._status_id(data['%>s']))
+        self.counts[key] = self.counts.get(key, 0) + 1
+
+    def process_batch(self, batch):
+        requests = batch['%r']
+        rids = [self._request_id(request) for request in requests.values]
+        statuses = batch.raw('%>s')
+        sids = [self._status_id(status) for status in statuses.values]
+        counts = self.counts
+        for code,status in zip(requests.codes, statuses.codes):
+            key = rids[code] << self._STATUS_BITS | sids[status]
+            counts[key] = counts.get(key, 0) + 1
+
+    def merge(self, other):
+        self._check_merge(other)
+        rids = [self._request_id(request) for request in other.requests]
+        sids = [self._status_id(status) for status in other.statuses]
+        mask = (1 << self._STATUS_BITS) - 1
+        for key,count in other.counts.items():
+            key = (rids[key >> self._STATUS_BITS] << self._STATUS_BITS |
+                   sids[key & mask])
+            self.counts[key] = self.counts.get(key, 0) + count
+
+    def _items(self):
+        "Iterate through ``(request, status, count)`` tuples."
+        mask = (1 << self._STATUS_BITS) - 1
+        for key,count in self.counts.items():
+            yield (self.requests[key >> self._STATUS_BITS],
+                   self.statuses[key & mask], count)
+
+    def request_counts(self):
+        "Return a ``request`` -> ``{status: count}`` dictionary."
+        requests = {}
+        for request,status,count in self._items():
+            requests.setdefault(request, {})[status] = count
+        return requests
+
+    def status_counts(self, top=None):
+        """Return a ``status`` -> ``[(request, count), ...]`` dictionary.
+
+        The requests for each status are sorted by decreasing count.
+        If ``top`` is set, only the ``top`` most common are returned.
+        """
+        statuses = {}
+        for request,status,count in self._items():
+            statuses.setdefault(status, []).append((request, count))
+        for status,requests in statuses.items():
+            requests.sort(key=lambda item: (-item[1], item[0]))
+            if top is not None:
+                del requests[top:]
+        return statuses
+
+    @property
+    def request(self):
+        return dict((request, set(counts))
+                    for request,counts in self.request_counts().items())
+
+    @property
+    def status(self):
+        return dict((status, set(request for request,count in requests))
+                    for status,requests in self.status_counts().items())
+
+    def __getstate__(self):
+        # the id maps are the inverses of the lists; rebuild them on load
+        state = super(StatusCountProcessor, self).__getstate__()
+        del state['_request_ids']
+        del state['_status_ids']
+        return state
+
+    def __setstate__(self, state):
+        super(StatusCountProcessor, self).__setstate__(state)
+        self._request_ids = dict(
+            (request, i) for i,request in enumerate(self.requests))
+        self._status_ids = dict(
+            (status, i) for i,status in enumerate(self.statuses))
@@ -1,6 +1,7 @@
-import datetime as _datetime
-
-from ..date import parse_time as _parse_time
+from ..column import argextremes as _argextremes
+from ..date import epoch_time as _epoch_time
+from ..date import parse_epoch_offset as _parse_epoch_offset
+from . import DERIVED as _DERIVED
 from . import Processor as _Processor
 
 
@@ -27,20 +28,117 @@ class LogTimeProcessor (_Processor):
     [18/Feb/2012:10:25:58 -0500]: 2012-02-18 10:25:58-05:00
     >>> ltp.total_seconds()
     15.0
+
+    The times may also have been converted to epoch seconds by the
+    parser.
+
+    >>> stream.seek(0)
+    >>> parser = Parser(FORMATS['extended'], converters=True)
+    >>> ltp = LogTimeProcessor()
+    >>> process(stream, parser, [ltp])
+    >>> print(ltp.start_time)
+    2012-02-18 15:25:43+00:00
+    >>> ltp.total_seconds()
+    15.0
+
+    Times are tracked as integer epoch seconds (with the offset of
+    the line they came from), and only converted to ``datetime``
+    instances when you ask for them.
+
+    >>> (ltp.start_epoch, ltp.stop_epoch)
+    (1329578743, 1329578758)
+
+    Columnar batches keep the offsets too.
+
+    >>> from apachelog.processor import process_columns
+    >>> stream.seek(0)
+    >>> ltp = LogTimeProcessor()
+    >>> process_columns(stream, Parser(FORMATS['extended']), [ltp])
+    >>> print(ltp.start_time)
+    2012-02-18 10:25:43-05:00
+    >>> print(ltp.last_time)
+    2012-02-18 10:25:58-05:00
     """
+    fields = ('%t',)
+    raw_fields = ('%t',)
+    derived = ('time',)
+    _transient = ('last_epoch', 'last_offset')
+    _UTC = '+0000'
+
     def __init__(self):
-        self.last_time = self.start_time = self.stop_time = None
+        self.start_epoch = self.stop_epoch = None
+        self.start_offset = self.stop_offset = None
+        self.last_epoch = self.last_offset = None
 
     def process(self, data):
-        time = _parse_time(data['%t'])
-        self.last_time = time  # for use by subclasses or other processors
-        if self.start_time is None or time < self.start_time:
-            self.start_time = time
-        if self.stop_time is None or time > self.stop_time:
-            self.stop_time = time
+        self._process_time(_DERIVED['time'](data))
+
+    def process_derived(self, data, derived):
+        self._process_time(derived.time)
+
+    def _process_time(self, time):
+        epoch,offset = time
+        # for use by subclasses or other processors
+        self.last_epoch = epoch
+        self.last_offset = offset
+        if self.start_epoch is None or epoch < self.start_epoch:
+            self.start_epoch = epoch
+            self.start_offset = offset
+        if self.stop_epoch is None or epoch > self.stop_epoch:
+            self.stop_epoch = epoch
+            self.stop_offset = offset
+
+    def process_batch(self, batch):
+        times = batch['%t']  # epoch seconds
+        if not len(times):
+            return
+        raw = batch.raw('%t')
+        if raw is times:  # no unconverted values
+            offset = lambda i: self._UTC
+        else:
+            offset = lambda i: _parse_epoch_offset(raw[i])[1]
+        start,stop = _argextremes(times)
+        self.last_epoch = int(times[-1])
+        self.last_offset = offset(-1)
+        if self.start_epoch is None or times[start] < self.start_epoch:
+            self.start_epoch = int(times[start])
+            self.start_offset = offset(start)
+        if self.stop_epoch is None or times[stop] > self.stop_epoch:
+            self.stop_epoch = int(times[stop])
+            self.stop_offset = offset(stop)
+
+    def merge(self, other):
+        self._check_merge(other)
+        if other.start_epoch is not None and (
+                self.start_epoch is None or
+                other.start_epoch < self.start_epoch):
+            self.start_epoch = other.start_epoch
+            self.start_offset = other.start_offset
+        if other.stop_epoch is not None and (
+                self.stop_epoch is None or
+                other.stop_epoch > self.stop_epoch):
+            self.stop_epoch = other.stop_epoch
+            self.stop_offset = other.stop_offset
+
+    @staticmethod
+    def _time(epoch, offset):
+        if epoch is None:
+            return None
+        return _epoch_time(epoch, offset)
+
+    @property
+    def start_time(self):
+        return self._time(self.start_epoch, self.start_offset)
+
+    @property
+    def stop_time(self):
+        return self._time(self.stop_epoch, self.stop_offset)
+
+    @property
+    def last_time(self):
+        return self._time(self.last_epoch, self.last_offset)
 
     def total_seconds(self):
-        if self.start_time is None:
+        if self.start_epoch is None:
             return 0
-        dt = self.stop_time - self.start_time
-        return dt.total_seconds()
+        return float(self.stop_epoch - self.start_epoch)
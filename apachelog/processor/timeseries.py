@@ -0,0 +1,193 @@
+from __future__ import division
+
+import array as _array
+import csv as _csv
+import json as _json
+
+from ..date import epoch_time as _epoch_time
+from . import DERIVED as _DERIVED
+from . import Processor as _Processor
+
+
+class TimeSeriesProcessor (_Processor):
+    r"""Count requests, bytes, and status classes in fixed-width buckets.
+
+    Each column is an ``array.array`` of per-bucket totals, indexed by
+    bucket from ``first`` (the epoch of the earliest bucket divided by
+    ``width``).  The arrays are preallocated and grown in chunks, so
+    most records just add to existing slots.  Buckets are aligned to
+    UTC.
+
+    >>> import StringIO
+    >>> from apachelog.parser import Parser, FORMATS
+    >>> from apachelog.processor import process
+    >>> stream = StringIO.StringIO('\n'.join([
+    ...         '192.168.0.1 - - [18/Feb/2012:10:25:43 -0500] "GET / HTTP/1.1" 200 560 "-" "Mozilla/5.0 (...)"',
+    ...         '192.168.0.1 - - [18/Feb/2012:10:25:43 -0500] "GET /style.css HTTP/1.1" 200 8240 "-" "Mozilla/5.0 (...)"',
+    ...         '192.168.0.2 - - [18/Feb/2012:12:25:58 -0500] "GET / HTTP/1.1" 404 - "-" "Mozilla/5.0 (...)"',
+    ...         ]))
+    >>> parser = Parser(FORMATS['extended'])
+    >>> tsp = TimeSeriesProcessor(interval='hour')
+    >>> process(stream, parser, [tsp])
+    >>> for row in tsp.rows():
+    ...     print(row)
+    (1329577200, 2, 8800, 0, 2, 0, 0, 0)
+    (1329580800, 0, 0, 0, 0, 0, 0, 0)
+    (1329584400, 1, 0, 0, 0, 0, 1, 0)
+    >>> tsp.peak('bytes')
+    (1329577200, 8800)
+    >>> import sys
+    >>> tsp.write_csv(sys.stdout)  # doctest: +NORMALIZE_WHITESPACE
+    epoch,time,requests,bytes,1xx,2xx,3xx,4xx,5xx
+    1329577200,2012-02-18T15:00:00+00:00,2,8800,0,2,0,0,0
+    1329580800,2012-02-18T16:00:00+00:00,0,0,0,0,0,0,0
+    1329584400,2012-02-18T17:00:00+00:00,1,0,0,0,0,1,0
+    >>> tsp.write_ndjson(sys.stdout, empty=False)
+    {"epoch": 1329577200, "time": "2012-02-18T15:00:00+00:00", "requests": 2, "bytes": 8800, "1xx": 0, "2xx": 2, "3xx": 0, "4xx": 0, "5xx": 0}
+    {"epoch": 1329584400, "time": "2012-02-18T17:00:00+00:00", "requests": 1, "bytes": 0, "1xx": 0, "2xx": 0, "3xx": 0, "4xx": 1, "5xx": 0}
+
+    Columnar batches and merged processors give the same totals.
+
+    >>> from apachelog.processor import process_columns
+    >>> stream.seek(0)
+    >>> tsp2 = TimeSeriesProcessor(interval='hour')
+    >>> process_columns(stream, parser, [tsp2])
+    >>> list(tsp2.rows()) == list(tsp.rows())
+    True
+    >>> tsp3 = TimeSeriesProcessor(interval='hour')
+    >>> tsp3.merge(tsp)
+    >>> tsp3.merge(tsp2)
+    >>> list(tsp3.rows())[0]
+    (1329577200, 4, 17600, 0, 4, 0, 0, 0)
+    """
+    INTERVALS = {
+        'minute': 60,
+        'hour': 60*60,
+        'day': 24*60*60,
+        }
+    COLUMNS = ('requests', 'bytes', '1xx', '2xx', '3xx', '4xx', '5xx')
+    CHUNK = 1024  # buckets to preallocate at a time
+    fields = ('%t', '%b', '%>s')
+    derived = ('time', 'bytes')
+
+    def __init__(self, interval='hour'):
+        self.interval = interval
+        self.width = self.INTERVALS[interval]
+        self.first = self.stop = None  # bucket range seen so far
+        self.columns = [_array.array('l') for name in self.COLUMNS]
+
+    def spawn(self):
+        return self.__class__(interval=self.interval)
+
+    def _reserve(self, first, last):
+        "Make room for the buckets from ``first`` through ``last``."
+        if self.first is None:
+            self.first = first
+            self.stop = last + 1
+        if first < self.first:
+            pad = _array.array('l', [0]) * (self.first - first)
+            self.columns = [pad + column for column in self.columns]
+            self.first = first
+        size = last + 1 - self.first
+        allocated = len(self.columns[0])
+        if size > allocated:
+            pad = _array.array('l', [0]) * max(
+                size - allocated, allocated, self.CHUNK)
+            for column in self.columns:
+                column.extend(pad)
+        if last >= self.stop:
+            self.stop = last + 1
+
+    def _add(self, epoch, b, status):
+        i = epoch // self.width
+        if self.first is None or not self.first <= i < self.stop:
+            self._reserve(i, i)
+        i -= self.first
+        columns = self.columns
+        columns[0][i] += 1
+        if b:
+            columns[1][i] += b
+        try:
+            status_class = int(status) // 100
+        except ValueError:
+            return
+        if 1 <= status_class <= 5:
+            columns[1 + status_class][i] += 1
+
+    def process(self, data):
+        epoch,offset = _DERIVED['time'](data)
+        self._add(epoch, _DERIVED['bytes'](data), data['%>s'])
+
+    def process_derived(self, data, derived):
+        epoch,offset = derived.time
+        self._add(epoch, derived.bytes, data['%>s'])
+
+    def process_batch(self, batch):
+        times = batch['%t']  # epoch seconds
+        if not len(times):
+            return
+        width = self.width
+        self._reserve(int(min(times)) // width, int(max(times)) // width)
+        first = self.first
+        requests,bytes_ = self.columns[:2]
+        classes = self.columns[1:]
+        for epoch,b,status in zip(times, batch['%b'], batch['%>s']):
+            i = int(epoch) // width - first
+            requests[i] += 1
+            bytes_[i] += int(b)
+            status_class = int(status) // 100
+            if 1 <= status_class <= 5:
+                classes[status_class][i] += 1
+
+    def merge(self, other):
+        self._check_merge(other)
+        if other.width != self.width:
+            raise ValueError('cannot merge {} buckets into {} buckets'.format(
+                    other.interval, self.interval))
+        if other.first is None:
+            return
+        self._reserve(other.first, other.stop - 1)
+        offset = other.first - self.first
+        for column,other_column in zip(self.columns, other.columns):
+            for i in range(other.stop - other.first):
+                column[offset + i] += other_column[i]
+
+    def rows(self, empty=True):
+        """Iterate through ``(epoch, requests, bytes, 1xx, ..., 5xx)``.
+
+        ``epoch`` is the start of the bucket.  Set ``empty`` to
+        ``False`` to skip buckets without requests.
+        """
+        if self.first is None:
+            return
+        width = self.width
+        size = self.stop - self.first
+        columns = [column[:size] for column in self.columns]
+        for i,row in enumerate(zip(*columns)):
+            if empty or row[0]:
+                yield ((self.first + i) * width,) + row
+
+    def peak(self, column='bytes'):
+        "Return ``(epoch, total)`` for the bucket with the largest total."
+        index = 1 + self.COLUMNS.index(column)
+        return max(((row[0], row[index]) for row in self.rows()),
+                   key=lambda item: item[1])
+
+    def _records(self, empty):
+        for row in self.rows(empty=empty):
+            yield (row[0], _epoch_time(row[0]).isoformat()) + row[1:]
+
+    def header(self):
+        return ('epoch', 'time') + self.COLUMNS
+
+    def write_csv(self, stream, empty=True):
+        writer = _csv.writer(stream, lineterminator='\n')
+        writer.writerow(self.header())
+        writer.writerows(self._records(empty=empty))
+
+    def write_ndjson(self, stream, empty=True):
+        encode = _json.JSONEncoder().encode
+        template = '{%s}\n' % ', '.join(
+            '{}: %s'.format(encode(name)) for name in self.header())
+        for record in self._records(empty=empty):
+            stream.write(template % tuple(encode(x) for x in record))
@@ -1,20 +1,178 @@
+import collections as _collections
+import json as _json
+import Queue as _queue
 import re as _re
 import socket as _socket
+import sqlite3 as _sqlite3
+import threading as _threading
+import time as _time
+
+
+class LRUCache (object):
+    """An in-memory ``Resolver`` cache holding at most ``maxsize`` IPs.
+
+    >>> cache = LRUCache(maxsize=2)
+    >>> cache['192.168.0.1'] = ('a.example.com', [], ['192.168.0.1'])
+    >>> cache['192.168.0.2'] = ('b.example.com', [], ['192.168.0.2'])
+    >>> cache['192.168.0.1'][0]
+    'a.example.com'
+    >>> cache['192.168.0.3'] = ('c.example.com', [], ['192.168.0.3'])
+    >>> sorted(cache.keys())
+    ['192.168.0.1', '192.168.0.3']
+    """
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self._data = _collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, ip):
+        return ip in self._data
+
+    def __getitem__(self, ip):
+        value = self._data.pop(ip)
+        self._data[ip] = value
+        return value
+
+    def get(self, ip, default=None):
+        try:
+            return self[ip]
+        except KeyError:
+            return default
+
+    def __setitem__(self, ip, value):
+        self._data.pop(ip, None)
+        if len(self._data) >= self.maxsize:
+            self._data.popitem(last=False)
+        self._data[ip] = value
+
+    def keys(self):
+        return list(self._data.keys())
+
+    def items(self):
+        return list(self._data.items())
+
+
+class SQLiteCache (object):
+    """A persistent ``Resolver`` cache stored in an SQLite database.
+
+    Successful lookups expire after ``ttl`` seconds and failed lookups
+    (where the name is just the IP) after ``negative_ttl`` seconds.
+    Several processes may share the same database file.
+
+    The cache stores the names returned by the resolver, so smart and
+    plain resolvers should not share a database.  It is only used for
+    lookups: ``Resolver.ips`` does not report IPs resolved in earlier
+    runs.
+
+    >>> import os, tempfile
+    >>> fd,path = tempfile.mkstemp(suffix='.sqlite')
+    >>> os.close(fd)
+    >>> cache = SQLiteCache(path, ttl=3600, negative_ttl=-1)
+    >>> cache['192.168.0.1'] = ('a.example.com', [], ['192.168.0.1'])
+    >>> cache['192.168.0.2'] = ('192.168.0.2', [], ['192.168.0.2'])
+    >>> cache.close()
+    >>> cache = SQLiteCache(path)
+    >>> cache['192.168.0.1']
+    ('a.example.com', [], ['192.168.0.1'])
+
+    The failed lookup has already expired.
+
+    >>> '192.168.0.2' in cache
+    False
+    >>> cache.items()
+    [('192.168.0.1', ('a.example.com', [], ['192.168.0.1']))]
+    >>> cache.close()
+    >>> os.remove(path)
+    """
+    def __init__(self, path, ttl=7*24*3600, negative_ttl=3600, timeout=30):
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._db = _sqlite3.connect(
+            path, timeout=timeout, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS hosts ('
+            'ip TEXT PRIMARY KEY, name TEXT, aliases TEXT, addresses TEXT, '
+            'expires REAL)')
+
+    def close(self):
+        self._db.close()
+
+    def __len__(self):
+        return self._db.execute(
+            'SELECT COUNT(*) FROM hosts WHERE expires > ?',
+            (_time.time(),)).fetchone()[0]
+
+    def __contains__(self, ip):
+        return self.get(ip) is not None
+
+    def __getitem__(self, ip):
+        value = self.get(ip)
+        if value is None:
+            raise KeyError(ip)
+        return value
+
+    def get(self, ip, default=None):
+        row = self._db.execute(
+            'SELECT name, aliases, addresses FROM hosts '
+            'WHERE ip = ? AND expires > ?', (ip, _time.time())).fetchone()
+        if row is None:
+            return default
+        return self._value(row)
+
+    def __setitem__(self, ip, value):
+        name,aliases,addresses = value
+        if name == ip:
+            ttl = self.negative_ttl
+        else:
+            ttl = self.ttl
+        self._db.execute(
+            'INSERT OR REPLACE INTO hosts VALUES (?, ?, ?, ?, ?)',
+            (ip, name, _json.dumps(list(aliases)),
+             _json.dumps(list(addresses)), _time.time() + ttl))
+
+    def keys(self):
+        return [ip for ip,value in self.items()]
+
+    def items(self):
+        rows = self._db.execute(
+            'SELECT ip, name, aliases, addresses FROM hosts '
+            'WHERE expires > ? ORDER BY ip', (_time.time(),))
+        return [(self._str(row[0]), self._value(row[1:])) for row in rows]
+
+    @staticmethod
+    def _str(value):
+        # sqlite3 returns unicode; IPs and host names are ASCII
+        return value.encode('ascii')
+
+    def _value(self, row):
+        name,aliases,addresses = row
+        return (self._str(name),
+                [self._str(x) for x in _json.loads(aliases)],
+                [self._str(x) for x in _json.loads(addresses)])
 
 
 class Resolver (object):
     """A simple reverse-DNS resolver.
 
     Maintains a class-level cache of resolved IPs to avoid repeated
-    lookups on the same IP address.
-
-    Avoid hanging if we can't resolve a name.
+    lookups on the same IP address.  Names are looked up with
+    ``socket.gethostbyaddr`` unless you pass another ``lookup``
+    function (taking an IP and returning a ``(name, aliases,
+    addresses)`` tuple).  Set ``socket.setdefaulttimeout`` to avoid
+    hanging if a name can't be resolved.
 
-    >>> import socket
-    >>> if hasattr(_socket, 'setdefaulttimeout'):
-    ...     socket.setdefaulttimeout(5)  # set 5 second timeout
-
-    >>> r = Resolver()
+    >>> HOSTS = {
+    ...     '198.41.0.4': 'a.root-servers.net',
+    ...     '66.249.68.33': 'crawl-66-249-68-33.googlebot.com',
+    ...     '66.249.68.34': 'crawl-66-249-68-34.googlebot.com',
+    ...     }
+    >>> def lookup(ip):
+    ...     return (HOSTS[ip], [], [ip])
+    >>> r = Resolver(lookup=lookup)
     >>> r.IP = {}  # clear cache of date from previous tests
     >>> r.resolve('198.41.0.4')
     'a.root-servers.net'
@@ -25,13 +183,22 @@ class Resolver (object):
     add an entry to the class-level ``REGEXPS``.  The entry should use
     your name as the key, and a list of matching regexps as the value.
     You need to enable this enhanced resolution using the ``smart``
-    argument.
+    argument.  The regexps are combined into a single pattern, so they
+    should not use flags or numbered backreferences.  If a host name
+    matches several entries, the entry whose name sorts first wins.
 
     >>> r.resolve('66.249.68.33')
     'crawl-66-249-68-33.googlebot.com'
-    >>> r = Resolver(smart=True)
+    >>> r = Resolver(smart=True, lookup=lookup)
     >>> r.resolve('66.249.68.34')
     'googlebot'
+    >>> sorted(r.ips('googlebot'))
+    ['66.249.68.34']
+
+    Use ``resolve_many`` to look up many addresses concurrently.
+
+    Pass a ``cache`` (e.g. an ``LRUCache`` or ``SQLiteCache``) to use
+    it instead of the class-level ``IP`` dictionary.
     """
     IP = {}
 
@@ -46,35 +213,243 @@ class Resolver (object):
         ]:
         REGEXPS[bot] = [_re.compile('.*{}.*'.format(bot))]
 
-    def __init__(self, smart=False):
+    def __init__(self, smart=False, lookup=None, threads=16, timeout=None,
+                 cache=None):
         self._smart = smart
+        if cache is not None:
+            self.IP = cache
+        if lookup is None:
+            lookup = _socket.gethostbyaddr
+        self._lookup = lookup
+        self.threads = threads
+        self.timeout = timeout
+        self._names = {}  # name -> set of IPs this resolver has resolved
 
     def resolve(self, ip):
-        if ip not in self.IP:
-            try:
-                self.IP[ip] = _socket.gethostbyaddr(ip)
-            except _socket.herror as e:
-                self.IP[ip] = (ip, [], [ip])
-            except _socket.gaierror as e:
-                self.IP[ip] = (ip, [], [ip])
+        value = self.IP.get(ip)
+        if value is None:
+            value = self._store(ip, self._try_lookup(ip))
+        else:
+            self._index(ip, value)
+        return value[0]
+
+    def resolve_many(self, ips, threads=None, timeout=None):
+        """Resolve a list of IPs, returning an ``ip`` -> ``name`` dict.
+
+        Uncached IPs are looked up in up to ``threads`` concurrent
+        threads.  Lookups that take longer than ``timeout`` seconds
+        are abandoned and treated as failures.  Both default to the
+        values given to the constructor.  An abandoned lookup keeps
+        its thread until it returns, so it still counts against
+        ``threads``; if every thread is stuck for another ``timeout``
+        seconds, the IPs that are left are returned unresolved (and
+        not cached).
+
+        >>> import time
+        >>> def lookup(ip):
+        ...     if ip == '192.168.0.3':
+        ...         time.sleep(10)  # unresponsive PTR
+        ...     if ip == '192.168.0.2':
+        ...         raise _socket.herror(1, 'Unknown host')
+        ...     return ('host-{}.example.com'.format(ip.split('.')[-1]),
+        ...             [], [ip])
+        >>> r = Resolver(lookup=lookup, threads=2, timeout=0.5)
+        >>> r.IP = {}  # use a fresh cache
+        >>> names = r.resolve_many(
+        ...     ['192.168.0.1', '192.168.0.2', '192.168.0.3', '192.168.0.4'])
+        >>> for ip,name in sorted(names.items()):
+        ...     print('{}\t{}'.format(ip, name))
+        ... # doctest: +NORMALIZE_WHITESPACE
+        192.168.0.1 host-1.example.com
+        192.168.0.2 192.168.0.2
+        192.168.0.3 192.168.0.3
+        192.168.0.4 host-4.example.com
+        >>> r = Resolver(lookup=lookup, threads=1, timeout=0.5)
+        >>> r.IP = {}
+        >>> sorted(r.resolve_many(['192.168.0.3', '192.168.0.4']).items())
+        [('192.168.0.3', '192.168.0.3'), ('192.168.0.4', '192.168.0.4')]
+        >>> '192.168.0.4' in r.IP
+        False
+        """
+        if threads is None:
+            threads = self.threads
+        if timeout is None:
+            timeout = self.timeout
+        names = {}
+        pending = []
+        for ip in ips:
+            if ip in names:
+                continue
+            value = self.IP.get(ip)
+            if value is None:
+                names[ip] = None
+                pending.append(ip)
             else:
-                if self._smart:
-                    self._smart_resolve(ip)
-        return self.IP[ip][0]
-
-    def _smart_resolve(self, ip):
-        x = self.IP[ip]
-        if self._smart:
-            for name,regexps in self.REGEXPS.items():
+                self._index(ip, value)
+                names[ip] = value[0]
+        pending.reverse()
+        results = _queue.Queue()
+        running = {}  # ip -> deadline
+        abandoned = set()  # timed out, but still holding a thread
+        while pending or running:
+            while pending and len(running) + len(abandoned) < threads:
+                ip = pending.pop()
+                thread = _threading.Thread(
+                    target=self._queue_lookup, args=(ip, results))
+                thread.daemon = True  # don't wait for abandoned lookups
+                thread.start()
+                if timeout is None:
+                    running[ip] = None
+                else:
+                    running[ip] = _time.time() + timeout
+            if not running:  # every thread is stuck on an abandoned lookup
+                wait = timeout
+            elif timeout is None:
+                wait = None
+            else:
+                wait = max(0, min(running.values()) - _time.time())
+            try:
+                ip,result = results.get(timeout=wait)
+            except _queue.Empty:
+                if not running:
+                    for ip in pending:
+                        names[ip] = ip
+                    del pending[:]
+                    continue
+                now = _time.time()
+                for ip,deadline in list(running.items()):
+                    if deadline <= now:
+                        del running[ip]
+                        abandoned.add(ip)
+                        names[ip] = self._store(ip, self._failure(ip))[0]
+                continue
+            if ip in running:
+                del running[ip]
+                if isinstance(result, Exception):
+                    raise result
+                names[ip] = self._store(ip, result)[0]
+            else:  # we've already given up on it, but the thread is free
+                abandoned.discard(ip)
+        return names
+
+    @staticmethod
+    def _failure(ip):
+        return (ip, [], [ip])
+
+    def _try_lookup(self, ip):
+        try:
+            return self._lookup(ip)
+        except (_socket.herror, _socket.gaierror, _socket.timeout) as e:
+            return self._failure(ip)
+
+    def _queue_lookup(self, ip, results):
+        try:
+            result = self._try_lookup(ip)
+        except Exception as e:  # re-raised in the main thread
+            result = e
+        results.put((ip, result))
+
+    def _store(self, ip, result):
+        # only called from the main thread, so the cache needs no lock
+        if self._smart and result[0] != ip:
+            result = self._smart_resolve(result)
+        self.IP[ip] = result
+        self._index(ip, result)
+        return result
+
+    def _index(self, ip, result):
+        # stale entries (e.g. for a previous name) are dropped by ips
+        self._names.setdefault(result[0], set()).add(ip)
+
+    @classmethod
+    def _matcher(cls):
+        """Return a single regexp matching any of the ``REGEXPS``.
+
+        The regexp is rebuilt whenever ``REGEXPS`` changes.  Each
+        alternative is a named group (``_0``, ``_1``, ...), and the
+        returned list gives the smart name for each group.
+        """
+        if cls.__dict__.get('_matcher_regexps') != cls.REGEXPS:
+            names = []
+            patterns = []
+            for name,regexps in sorted(cls.REGEXPS.items()):
                 for regexp in regexps:
-                    if regexp.match(self.IP[ip][0]):
-                        self.IP[ip] = (name, x[1], x[2])
+                    patterns.append('(?P<_{}>{})'.format(
+                            len(names), regexp.pattern))
+                    names.append(name)
+            cls._matcher_cache = (_re.compile('|'.join(patterns)), names)
+            cls._matcher_regexps = dict(
+                (name, list(regexps)) for name,regexps in cls.REGEXPS.items())
+        return cls._matcher_cache
+
+    def _smart_resolve(self, result):
+        """Replace the host name with the first matching ``REGEXPS`` name.
+
+        >>> r = Resolver(smart=True)
+        >>> r._smart_resolve(('crawl.googlebot.yandex.com', [], []))
+        ('googlebot', [], [])
+        """
+        regexp,names = self._matcher()
+        match = regexp.match(result[0])
+        if match is None:
+            return result
+        name = names[int(match.lastgroup[1:])]
+        return (name, result[1], result[2])
 
     def ips(self, name):
-        "Return a set of IP addresses used by a smart-resolved name."
+        """Return a set of IP addresses used by a smart-resolved name.
+
+        Only IPs this resolver has resolved (or found in its cache)
+        are considered, so a persistent cache is never scanned.
+
+        >>> def lookup(ip):
+        ...     return ('crawl-{}.googlebot.com'.format(ip.replace('.', '-')),
+        ...             [], [ip])
+        >>> r = Resolver(smart=True, lookup=lookup)
+        >>> r.IP = {}  # use a fresh cache
+        >>> sorted(r.resolve_many(['66.249.68.33', '66.249.68.34']).items())
+        [('66.249.68.33', 'googlebot'), ('66.249.68.34', 'googlebot')]
+        >>> sorted(r.ips('googlebot'))
+        ['66.249.68.33', '66.249.68.34']
+        >>> r.ips('yandex')
+        set([])
+
+        Evicted, expired, and renamed entries are dropped.
+
+        >>> r.IP = LRUCache(maxsize=2)
+        >>> names = r.resolve_many(['66.249.68.33', '66.249.68.34'])
+        >>> r.IP['66.249.68.34'] = ('example.com', [], ['66.249.68.34'])
+        >>> r.resolve('66.249.68.35')
+        'googlebot'
+        >>> sorted(r.ips('googlebot'))
+        ['66.249.68.35']
+
+        IPs resolved by an earlier run with the same ``SQLiteCache``
+        are not included.
+
+        >>> import os, tempfile
+        >>> fd,path = tempfile.mkstemp(suffix='.sqlite')
+        >>> os.close(fd)
+        >>> r = Resolver(smart=True, lookup=lookup, cache=SQLiteCache(path))
+        >>> r.resolve('66.249.68.33')
+        'googlebot'
+        >>> r.IP.close()
+        >>> r = Resolver(smart=True, lookup=lookup, cache=SQLiteCache(path))
+        >>> r.resolve('66.249.68.34')
+        'googlebot'
+        >>> sorted(r.ips('googlebot'))
+        ['66.249.68.34']
+        >>> r.IP.close()
+        >>> os.remove(path)
+        """
+        cached = self._names.get(name)
+        if not cached:
+            return set()
         ips = set()
-        for ip,values in self.IP.items():
-            if values[0] == name:
-                for x in values[2]:
-                    ips.add(x)
+        for ip in list(cached):
+            values = self.IP.get(ip)
+            if values is None or values[0] != name:
+                cached.discard(ip)
+            else:
+                ips.update(values[2])
         return ips
@@ -0,0 +1,304 @@
+"""Bounded-memory summaries of the values in a log field.
+
+``HyperLogLog`` estimates how many distinct values it has seen,
+``BottomKSample`` keeps a uniform random sample of them, and
+``SpaceSaving`` tracks the values with the largest totals.  They all
+use a fixed amount of memory, and they can all be merged, so partial
+results from separate workers combine into a summary of everything.
+"""
+
+from __future__ import division
+
+import hashlib as _hashlib
+import heapq as _heapq
+import math as _math
+import struct as _struct
+
+
+_UNPACK_HASH = _struct.Struct('<Q').unpack
+
+
+def hash64(value):
+    """Return a 64-bit hash of a string, stable between processes.
+
+    Other values (e.g. converted status codes) are hashed as strings.
+
+    >>> hash64('192.168.0.1')
+    4557237059147070960
+    >>> hash64(200) == hash64('200')
+    True
+    """
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    elif not isinstance(value, str):
+        value = str(value)
+    return _UNPACK_HASH(_hashlib.md5(value).digest()[:8])[0]
+
+
+class HyperLogLog (object):
+    """Estimate the number of distinct values added.
+
+    Uses ``2**precision`` one-byte registers, for a relative standard
+    error of about ``1.04/sqrt(2**precision)`` (1.6% for the default
+    precision of 12).
+
+    >>> a = HyperLogLog()
+    >>> for i in range(5000):
+    ...     a.add('192.168.{}.{}'.format(i // 256, i % 256))
+    >>> b = HyperLogLog()
+    >>> for i in range(2500, 10000):
+    ...     b.add('192.168.{}.{}'.format(i // 256, i % 256))
+    >>> round(a.error(), 4)
+    0.0163
+    >>> abs(a.cardinality() - 5000) < 3 * a.error() * 5000
+    True
+    >>> a.merge(b)
+    >>> abs(a.cardinality() - 10000) < 3 * a.error() * 10000
+    True
+    """
+    def __init__(self, precision=12):
+        if not 4 <= precision <= 18:
+            raise ValueError('precision must be between 4 and 18')
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+        self._shift = 64 - precision
+        self._mask = (1 << self._shift) - 1
+
+    def add(self, value):
+        self.add_hash(hash64(value))
+
+    def add_hash(self, h):
+        "Add a value by its ``hash64``."
+        i = h >> self._shift
+        rank = self._shift - (h & self._mask).bit_length() + 1
+        if rank > self.registers[i]:
+            self.registers[i] = rank
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError(
+                'cannot merge precision {} into precision {}'.format(
+                    other.precision, self.precision))
+        self.registers = bytearray(
+            max(a, b) for a,b in zip(self.registers, other.registers))
+
+    def cardinality(self):
+        "Return the estimated number of distinct values."
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count('\x00')
+        if estimate <= 2.5 * m and zeros:  # small range correction
+            estimate = m * _math.log(m / zeros)
+        return int(round(estimate))
+
+    def error(self):
+        "Return the relative standard error of ``cardinality``."
+        return 1.04 / _math.sqrt(len(self.registers))
+
+
+class BottomKSample (object):
+    """Keep a random sample of up to ``size`` distinct values.
+
+    The sample holds the values with the smallest hashes, so merging
+    two samples gives the same result as sampling everything at once.
+
+    >>> a = BottomKSample(size=3)
+    >>> for value in ['a', 'b', 'c', 'd', 'a']:
+    ...     a.add(value)
+    >>> b = BottomKSample(size=3)
+    >>> for value in ['e', 'f', 'g']:
+    ...     b.add(value)
+    >>> c = BottomKSample(size=3)
+    >>> for value in 'abcdefg':
+    ...     c.add(value)
+    >>> a.merge(b)
+    >>> a.values() == c.values()
+    True
+    >>> len(a.values())
+    3
+    """
+    def __init__(self, size=10):
+        self.size = size
+        self._sample = {}  # hash -> value
+        self._limit = None  # hashes from here up are never sampled
+
+    def add(self, value):
+        self.add_hash(hash64(value), value)
+
+    def add_hash(self, h, value):
+        "Add a value with its precomputed ``hash64``."
+        if self._limit is not None and h >= self._limit:
+            return
+        self._sample[h] = value
+        if len(self._sample) >= 2 * self.size:
+            self._prune()
+
+    def _prune(self):
+        keep = sorted(self._sample)[:self.size]
+        self._sample = dict((h, self._sample[h]) for h in keep)
+        if len(keep) == self.size:
+            self._limit = keep[-1] + 1
+
+    def merge(self, other):
+        for h,value in other._sample.items():
+            self.add_hash(h, value)
+        self._prune()
+
+    def values(self):
+        "Return the sampled values, sorted."
+        self._prune()
+        return sorted(self._sample.values())
+
+
+class SpaceSaving (object):
+    """Track the ``size`` values with the largest weighted totals.
+
+    This is the Space-Saving algorithm.  ``counts`` maps each tracked
+    value to its total, which may overestimate the true total by at
+    most ``errors[value]``.  Every error is at most the smallest
+    tracked count, which is at most ``total / size``, so any value
+    whose true total exceeds that is guaranteed to be tracked.
+
+    >>> s = SpaceSaving(size=2)
+    >>> for value,weight in [('a', 10), ('b', 1), ('c', 2), ('a', 5)]:
+    ...     s.add(value, weight)
+    >>> sorted(s.counts.items())
+    [('a', 15), ('c', 3)]
+    >>> sorted(s.errors.items())
+    [('a', 0), ('c', 1)]
+    >>> s.total
+    18
+
+    Merging gives the same guarantees for the combined stream.
+
+    >>> t = SpaceSaving(size=2)
+    >>> for value,weight in [('b', 7), ('c', 1)]:
+    ...     t.add(value, weight)
+    >>> s.merge(t)
+    >>> sorted(s.counts.items())
+    [('a', 16), ('b', 10)]
+    >>> sorted(s.errors.items())
+    [('a', 1), ('b', 3)]
+    """
+    def __init__(self, size=100):
+        if size < 1:
+            raise ValueError('size must be positive')
+        self.size = size
+        self.total = 0
+        self.counts = {}
+        self.errors = {}
+        self._heap = []  # (count, value), counts may be stale (too low)
+        self._floor = 0  # overestimate for untracked values when not full
+        self._error_bound = 0  # for errors from rename and merge
+
+    def add(self, value, weight=1):
+        self.total += weight
+        counts = self.counts
+        if value in counts:
+            counts[value] += weight
+            return
+        if len(counts) < self.size:
+            floor = self._floor
+            counts[value] = floor + weight
+            self.errors[value] = floor
+            _heapq.heappush(self._heap, (floor + weight, value))
+            return
+        smallest,count = self._pop_smallest()
+        del self.errors[smallest]
+        counts[value] = count + weight
+        self.errors[value] = count
+        _heapq.heappush(self._heap, (count + weight, value))
+
+    def _smallest(self):
+        """Return ``(value, count)`` for the smallest count.
+
+        Stale entries are only fixed when they reach the top of the
+        heap, so this is amortized constant time.
+        """
+        heap = self._heap
+        counts = self.counts
+        while True:
+            count,value = heap[0]
+            current = counts.get(value)
+            if current == count:
+                return (value, count)
+            if current is None:  # renamed away
+                _heapq.heappop(heap)
+            else:
+                _heapq.heapreplace(heap, (current, value))
+
+    def _pop_smallest(self):
+        "Remove and return ``(value, count)`` for the smallest count."
+        value,count = self._smallest()
+        _heapq.heappop(self._heap)
+        del self.counts[value]
+        return (value, count)
+
+    def minimum(self):
+        "Return the overestimate for untracked values."
+        if len(self.counts) < self.size:
+            return self._floor
+        return self._smallest()[1]
+
+    def max_error(self):
+        """Return a bound on the overestimate for any value.
+
+        Errors from ``add`` never exceed ``minimum``, so this is only
+        larger after a ``rename`` or ``merge`` (and may then stay
+        larger than the errors of the values still tracked).
+        """
+        return max(self._error_bound, self.minimum())
+
+    def rename(self, value, name):
+        """Move the total for ``value`` onto ``name``.
+
+        For consolidating values, e.g. IPs by resolved host name.
+        Untracked values keep the overestimate they had before.
+
+        >>> s = SpaceSaving(size=2)
+        >>> for value,weight in [('a', 10), ('b', 1), ('c', 2)]:
+        ...     s.add(value, weight)
+        >>> s.rename('a', 'c')
+        >>> s.counts
+        {'c': 13}
+        >>> s.minimum()
+        3
+        >>> s.add('d', 1)
+        >>> s.counts['d'], s.errors['d']
+        (4, 3)
+        """
+        self._floor = max(self._floor, self.minimum())
+        count = self.counts.pop(value)
+        error = self.errors.pop(value)
+        if name in self.counts:
+            self.counts[name] += count
+            self.errors[name] += error
+        else:
+            self.counts[name] = count
+            self.errors[name] = error
+            _heapq.heappush(self._heap, (count, name))
+        self._error_bound = max(self._error_bound, self.errors[name])
+
+    def merge(self, other):
+        minimum = self.minimum()
+        other_minimum = other.minimum()
+        self._floor = minimum + other_minimum
+        counts = {}
+        errors = {}
+        for value in set(self.counts).union(other.counts):
+            counts[value] = (self.counts.get(value, minimum) +
+                             other.counts.get(value, other_minimum))
+            errors[value] = (self.errors.get(value, minimum) +
+                             other.errors.get(value, other_minimum))
+        keep = sorted(
+            counts, key=lambda v: (counts[v], v), reverse=True)[:self.size]
+        self.total += other.total
+        self.counts.clear()
+        self.errors.clear()
+        for value in keep:
+            self.counts[value] = counts[value]
+            self.errors[value] = errors[value]
+        self._error_bound = max([0] + [errors[value] for value in keep])
+        self._heap = [(count, value) for value,count in self.counts.items()]
+        _heapq.heapify(self._heap)
@@ -0,0 +1,247 @@
+r"""Save processing state between runs over growing logs.
+
+A ``State`` remembers how far each log has been read and the
+processors that read it.  On the next run only the new lines are
+processed, and the results are merged into the saved processors (see
+``Processor.merge``).  Logs are recognized by their inode and a hash
+of their first bytes rather than by name, so a rotated log is resumed
+under its new name, and a replaced log is read from the start.
+
+>>> import os, tempfile
+>>> from apachelog.parser import Parser, FORMATS
+>>> from apachelog.processor import process
+>>> from apachelog.processor.bandwidth import BandwidthProcessor
+>>> directory = tempfile.mkdtemp()
+>>> filename = os.path.join(directory, 'access_log')
+>>> path = os.path.join(directory, 'state')
+>>> line = ('192.168.0.1 - - [18/Feb/2012:10:25:{:02d} -0500] '
+...         '"GET / HTTP/1.1" 200 100 "-" "-"\n')
+>>> parser = Parser(FORMATS['extended'])
+>>> def run(*filenames):
+...     state = State.load(path)
+...     processors = [BandwidthProcessor()]
+...     for name in filenames or [filename]:
+...         with state.open(name) as stream:
+...             process(stream, parser, processors)
+...     processors = state.merge_processors(processors)
+...     state.save(path)
+...     return processors[0]
+>>> with open(filename, 'w') as f:
+...     f.write(line.format(0) + line.format(10))
+>>> bwp = run()
+>>> (bwp.bytes, bwp.total_seconds())
+(200, 10.0)
+
+The next run only reads the new lines (the last one is incomplete).
+
+>>> with open(filename, 'a') as f:
+...     f.write(line.format(20) + line.format(30)[:20])
+>>> bwp = run()
+>>> (bwp.bytes, bwp.total_seconds())
+(300, 20.0)
+>>> with open(filename, 'a') as f:
+...     f.write(line.format(30)[20:])
+>>> bwp = run()
+>>> (bwp.bytes, bwp.total_seconds())
+(400, 30.0)
+
+After rotation, the rotated log is resumed where the last run
+stopped, and the new log is read from its start.  Lines added to the
+rotated log are only read if you include it in the run.
+
+>>> with open(filename, 'a') as f:
+...     f.write(line.format(40))
+>>> os.rename(filename, filename + '.1')
+>>> with open(filename, 'w') as f:
+...     f.write(line.format(50))
+>>> bwp = run(filename + '.1', filename)
+>>> (bwp.bytes, bwp.total_seconds())
+(600, 50.0)
+>>> bwp = run(filename, filename + '.1')
+>>> bwp.bytes
+600
+>>> for name in os.listdir(directory):
+...     os.remove(os.path.join(directory, name))
+>>> os.rmdir(directory)
+"""
+
+import hashlib as _hashlib
+import os as _os
+import os.path as _os_path
+import pickle as _pickle
+
+from . import file as _file
+
+
+"""Number of bytes at the start of a log used to recognize it
+"""
+HEAD_SIZE = 1024
+
+
+def _head_hash(filename, size):
+    with open(filename, 'rb') as f:
+        return _hashlib.md5(f.read(size)).hexdigest()
+
+
+class _NewLines (object):
+    "Iterate through the new, complete lines of a log."
+    def __init__(self, state, key, filename, offset, **kwargs):
+        self._state = state
+        self._key = key
+        self._filename = filename
+        self._offset = offset
+        self._kwargs = kwargs
+        self._stream = None
+
+    def __iter__(self):
+        if self._offset is None:  # an unchanged compressed log
+            return
+        extension = _os_path.splitext(self._filename)[-1]
+        openers = self._kwargs.get('openers') or _file.OPENERS
+        if extension in openers:
+            self._stream = _file.open(self._filename, **self._kwargs)
+            for line in self._stream:
+                yield line
+            self._offset = _os_path.getsize(self._filename)
+            self._state._consumed(self._key, self._offset)
+            return
+        self._stream = open(self._filename, 'rb')
+        self._stream.seek(self._offset)
+        for line in self._stream:
+            if not line.endswith('\n'):
+                break  # still being written
+            self._offset += len(line)
+            yield line
+        self._state._consumed(self._key, self._offset)
+
+    def close(self):
+        if self._stream is not None:
+            self._stream.close()
+            if self._offset is not None:
+                self._state._consumed(self._key, self._offset)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+
+class State (object):
+    """Offsets into logs, and the processors that have read them.
+
+    ``files`` maps each log's ``(device, inode)`` to a ``(head_size,
+    head_hash, filename, offset)`` tuple, where ``filename`` is the
+    name it was last read under.
+    """
+    VERSION = 2
+
+    def __init__(self, files=None, processors=None):
+        if files is None:
+            files = {}
+        self.files = files
+        self.processors = processors
+
+    @classmethod
+    def load(cls, path):
+        "Load a saved state, or return an empty one if there is none."
+        if not _os_path.exists(path):
+            return cls()
+        with open(path, 'rb') as f:
+            data = _pickle.load(f)
+        if data.get('version') != cls.VERSION:
+            raise ValueError('unsupported state version in {}'.format(path))
+        return cls(files=data['files'], processors=data['processors'])
+
+    def save(self, path):
+        "Save the state, replacing ``path`` atomically."
+        tmp = '{}.tmp'.format(path)
+        with open(tmp, 'wb') as f:
+            _pickle.dump({
+                    'version': self.VERSION,
+                    'files': self.files,
+                    'processors': self.processors,
+                    }, f, _pickle.HIGHEST_PROTOCOL)
+        _os.rename(tmp, path)
+
+    @staticmethod
+    def _key(filename):
+        st = _os.stat(filename)
+        return ((st.st_dev, st.st_ino), st.st_size)
+
+    def offset(self, filename):
+        """Return the offset to resume reading ``filename`` from.
+
+        The saved offset is found by the log's inode and head hash, so
+        it follows the log when it is renamed.  Returns 0 for new,
+        replaced, or truncated logs, and ``None`` for compressed logs
+        that have already been read.
+        """
+        key,size = self._key(filename)
+        saved = self.files.get(key)
+        if saved is None:
+            return 0
+        head_size,head_hash,name,offset = saved
+        if (size < offset or
+                _head_hash(filename, head_size) != head_hash):
+            return 0
+        extension = _os_path.splitext(filename)[-1]
+        if extension in _file.OPENERS:
+            if size == offset:
+                return None
+            return 0
+        return offset
+
+    def open(self, filename, **kwargs):
+        """Open ``filename`` for reading the lines added since last time.
+
+        Only complete lines are read from uncompressed logs, so a line
+        that is still being written is left for the next run.
+        Compressed logs are read whole, or not at all if they have
+        already been read.  ``kwargs`` are passed on to
+        ``apachelog.file.open``.
+        """
+        key,size = self._key(filename)
+        offset = self.offset(filename)
+        if offset == 0:  # a new log (or a reused inode), so a new identity
+            head_size = min(HEAD_SIZE, size)
+            self.files[key] = (
+                head_size, _head_hash(filename, head_size), filename, 0)
+        else:
+            head_size,head_hash,name,saved = self.files[key]
+            self.files[key] = (head_size, head_hash, filename, saved)
+        return _NewLines(
+            state=self, key=key, filename=filename, offset=offset, **kwargs)
+
+    def _consumed(self, key, offset):
+        self.files[key] = self.files[key][:3] + (offset,)
+
+    @staticmethod
+    def _signature(processors):
+        return [(type(p).__name__, p.fields) for p in processors]
+
+    def check_processors(self, processors):
+        """Raise ``ValueError`` if ``processors`` don't match the saved ones.
+        """
+        if self.processors is None:
+            return
+        if self._signature(self.processors) != self._signature(processors):
+            raise ValueError(
+                'the saved state is for different processors ({})'.format(
+                    ', '.join(name for name,fields in self._signature(
+                                self.processors))))
+
+    def merge_processors(self, processors):
+        """Merge ``processors`` into the saved processors.
+
+        Returns the merged processors (and remembers them for
+        ``save``).  If there are no saved processors, ``processors``
+        are used as they are.
+        """
+        self.check_processors(processors)
+        if self.processors is None:
+            self.processors = processors
+            return processors
+        for saved,processor in zip(self.processors, processors):
+            saved.merge(processor)
+        return self.processors
@@ -1,6 +1,7 @@
 import unittest
 
-from ..parser import ApacheLogParserError, FORMATS, Parser
+from ..parser import ApacheLogParserError, BytesAttrDict, FORMATS, Parser
+from ..parser import BytesRecord, Record
 
 
 class TestApacheLogParser(unittest.TestCase):
@@ -278,6 +279,268 @@ class TestApacheLogParserFriendlyNames(unittest.TestCase):
         self.assertEqual(data['%b'],'xyz', '%c')
         self.assertEqual(data['%c'],'bar', '%c')
 
+class TestApacheLogParserIter(unittest.TestCase):
+
+    def setUp(self):
+        self.p = Parser(FORMATS['common'])
+        self.lines = [
+            '192.168.0.1 - - [18/Feb/2012:10:25:43 -0500] '
+            '"GET / HTTP/1.1" 200 561\n',
+            'junk line\n',
+            '192.168.0.2 - - [18/Feb/2012:10:25:58 -0500] '
+            '"GET /style.css HTTP/1.1" 404 -\n',
+            ]
+
+    def testsameasparse(self):
+        good = [self.lines[0], self.lines[2]]
+        self.assertEqual(
+            [self.p.parse(line) for line in good], self.p.parse_many(good))
+
+    def testraise(self):
+        records = self.p.parse_iter(self.lines)
+        self.assertEqual(next(records)['%h'], '192.168.0.1')
+        self.assertRaises(ApacheLogParserError, next, records)
+
+    def testskip(self):
+        records = self.p.parse_many(self.lines, errors='skip')
+        self.assertEqual([r['%h'] for r in records],
+                         ['192.168.0.1', '192.168.0.2'])
+
+    def testcollect(self):
+        bad_lines = []
+        records = self.p.parse_many(
+            self.lines, errors='collect', bad_lines=bad_lines)
+        self.assertEqual(len(records), 2)
+        self.assertEqual(bad_lines, ['junk line\n'])
+
+    def testbadpolicy(self):
+        self.assertRaises(ValueError, self.p.parse_many, self.lines, 'ignore')
+        self.assertRaises(ValueError, self.p.parse_many, self.lines, 'collect')
+
+class TestApacheLogParserBinary(unittest.TestCase):
+
+    def setUp(self):
+        self.p = Parser(FORMATS['extended'], binary=True)
+        self.line = (
+            b'192.168.0.1 - - [18/Feb/2012:10:25:43 -0500] '
+            b'"GET /caf\xc3\xa9 HTTP/1.1" 200 561 "-" "Mozilla/5.0 (...)"\n')
+
+    def testbytes(self):
+        data = self.p.parse(self.line)
+        self.assertTrue(isinstance(data, BytesAttrDict))
+        self.assertEqual(data['%h'], b'192.168.0.1')
+        self.assertEqual(data['%>s'], b'200')
+        self.assertTrue(isinstance(data['%r'], bytes))
+
+    def testtext(self):
+        data = self.p.parse(self.line)
+        self.assertEqual(data.text('%r'), u'GET /caf\xe9 HTTP/1.1')
+
+    def testiter(self):
+        records = self.p.parse_many([self.line, b'junk\n'], errors='skip')
+        self.assertEqual([r['%b'] for r in records], [b'561'])
+
+class TestApacheLogParserFields(unittest.TestCase):
+
+    def setUp(self):
+        self.line = (
+            '192.168.0.1 - - [18/Feb/2012:10:25:43 -0500] '
+            '"GET / HTTP/1.1" 200 561 "-" "Mozilla/5.0 (...)"')
+
+    def testprojection(self):
+        p = Parser(FORMATS['extended'], fields=['%t', '%b'])
+        self.assertEqual(p.names(), ['%t', '%b'])
+        self.assertEqual(
+            p.parse(self.line),
+            {'%t': '[18/Feb/2012:10:25:43 -0500]', '%b': '561'})
+
+    def testfriendlyprojection(self):
+        p = Parser(FORMATS['extended'], True, fields=['%h', 'header_Referer'])
+        data = p.parse(self.line)
+        self.assertEqual(sorted(data.keys()), ['header_Referer', 'remote_host'])
+        self.assertEqual(data.header_Referer, '-')
+
+    def testtrailingskipped(self):
+        p = Parser(FORMATS['extended'], fields=['%h'])
+        self.assertEqual(p.pattern(), '^(\\S*) .*$')
+        self.assertRaises(ApacheLogParserError, p.parse, 'foobar')
+
+    def testmatchesfull(self):
+        full = Parser(FORMATS['extended'])
+        p = Parser(FORMATS['extended'], fields=['%r', '%{User-Agent}i'])
+        data = full.parse(self.line)
+        self.assertEqual(p.parse(self.line), {
+            '%r': data['%r'], '%{User-Agent}i': data['%{User-Agent}i']})
+
+    def testunknownfield(self):
+        self.assertRaises(
+            ApacheLogParserError, Parser, FORMATS['common'], fields=['%D'])
+
+class TestApacheLogParserSplitVerified(TestApacheLogParser):
+    """Rerun the fixtures, checking the split parser against the regex."""
+
+    def setUp(self):
+        super(TestApacheLogParserSplitVerified, self).setUp()
+        self.p = Parser(self.format, fast='verify')
+        self.regex = Parser(self.format, fast=False)
+        self.line4 = r'212.74.15.68 - - [23/Jan/2004:11:36:20 +0000] '\
+                     r'"GET /images/previous.png HTTP/1.1" 200 2607 '\
+                     r'"-" "Mozilla/5.0 (X11; U; Linux i686)"'
+
+    def testsameasregex(self):
+        for line in [self.line1, self.line2, self.line3, self.line4]:
+            self.assertEqual(self.p.parse(line), self.regex.parse(line))
+
+    def testsplitused(self):
+        self.assertNotEqual(self.p._fast(self.line4), None)
+        self.assertEqual(self.p._fast(self.line2), None)  # escaped quote
+
+    def testurlfallback(self):
+        p = Parser(r'%h %U %>s', fast='verify')
+        self.assertEqual(p._fast, None)
+        self.assertEqual(p.parse('a /b c 200')['%U'], '/b c')
+
+    def testmalformed(self):
+        for line in ['foobar', '', 'a b c [d] "e" f g', self.line4 + ' x',
+                     self.line4.replace('[', '', 1)]:
+            self.assertRaises(ApacheLogParserError, self.p.parse, line)
+
+
+class TestApacheLogParserFriendlyNamesSplitVerified(
+        TestApacheLogParserFriendlyNames):
+
+    def setUp(self):
+        super(TestApacheLogParserFriendlyNamesSplitVerified, self).setUp()
+        self.p = Parser(self.format, True, fast='verify')
+
+class TestApacheLogParserConverters(unittest.TestCase):
+
+    def setUp(self):
+        self.p = Parser(FORMATS['extended'], converters=True)
+        self.line = (
+            '192.168.0.1 - - [18/Feb/2012:10:25:43 -0500] '
+            '"GET / HTTP/1.1" 404 - "-" "Mozilla/5.0 (...)"')
+
+    def testtypes(self):
+        data = self.p.parse(self.line)
+        self.assertEqual(data['%>s'], 404)
+        self.assertEqual(data['%b'], 0)
+        self.assertEqual(data['%t'], 1329578743)
+        self.assertEqual(data['%h'], '192.168.0.1')
+
+    def testinterned(self):
+        a, b = self.p.parse_many([self.line, self.line])
+        self.assertTrue(a['%>s'] is b['%>s'])
+
+    def testcustom(self):
+        p = Parser(FORMATS['common'], converters={'%>s': int},
+                   interned=('%h',))
+        line = self.line.rsplit(' "-"', 1)[0]
+        a, b = p.parse_many([line, line], errors='raise')
+        self.assertEqual(a['%>s'], 404)
+        self.assertEqual(a['%b'], '-')
+        self.assertTrue(a['%h'] is b['%h'])
+
+    def testbadvalue(self):
+        line = self.line.replace(' 404 ', ' xyz ')
+        self.assertRaises(ApacheLogParserError, self.p.parse, line)
+        self.assertEqual(self.p.parse_many([line], errors='skip'), [])
+
+class TestApacheLogParserCompact(unittest.TestCase):
+
+    def setUp(self):
+        self.line = (
+            '192.168.0.1 - - [18/Feb/2012:10:25:43 -0500] '
+            '"GET / HTTP/1.1" 200 561 "-" "Mozilla/5.0 (...)"')
+        self.p = Parser(FORMATS['extended'], compact=True)
+
+    def testaccess(self):
+        data = self.p.parse(self.line)
+        self.assertTrue(isinstance(data, Record))
+        self.assertEqual(data[0], '192.168.0.1')
+        self.assertEqual(data['%h'], '192.168.0.1')
+        self.assertEqual(data['remote_host'], '192.168.0.1')
+        self.assertEqual(data.remote_host, '192.168.0.1')
+        self.assertEqual(data.header_User_Agent, 'Mozilla/5.0 (...)')
+        self.assertEqual(data[-1], 'Mozilla/5.0 (...)')
+        self.assertEqual(data[3:5], (
+                '[18/Feb/2012:10:25:43 -0500]', 'GET / HTTP/1.1'))
+        self.assertRaises(KeyError, lambda: data['%D'])
+        self.assertEqual(data.get('%D'), None)
+
+    def testsameasdict(self):
+        data = Parser(FORMATS['extended']).parse(self.line)
+        self.assertEqual(self.p.parse(self.line)._asdict(), data)
+        self.assertEqual(sorted(self.p.parse(self.line).keys()),
+                         sorted(data.keys()))
+
+    def testfriendlynames(self):
+        p = Parser(FORMATS['common'], True, compact=True, fields=['%b'])
+        data = p.parse_many([self.line.rsplit(' "-"', 1)[0]])[0]
+        self.assertEqual(data.keys(), ['response_bytes_clf'])
+        self.assertEqual(data['%b'], data.response_bytes_clf)
+
+    def testnodict(self):
+        data = self.p.parse(self.line)
+        self.assertRaises(AttributeError, setattr, data, 'x', 1)
+
+    def testpickle(self):
+        import pickle
+        data = self.p.parse(self.line)
+        copy = pickle.loads(pickle.dumps(data, pickle.HIGHEST_PROTOCOL))
+        self.assertEqual(copy, data)
+        self.assertEqual(copy.remote_host, '192.168.0.1')
+        self.assertTrue('remote_host' in copy)
+        self.assertFalse('192.168.0.1' in copy)
+
+    def testbinarytext(self):
+        p = Parser(FORMATS['extended'], binary=True, compact=True)
+        data = p.parse(self.line.encode('ascii'))
+        self.assertTrue(isinstance(data, BytesRecord))
+        self.assertEqual(data.text('%h'), u'192.168.0.1')
+
+class TestApacheLogParserColumns(unittest.TestCase):
+
+    def setUp(self):
+        self.lines = [
+            '192.168.0.1 - - [18/Feb/2012:10:25:43 -0500] '
+            '"GET / HTTP/1.1" 200 561 "-" "Mozilla/5.0 (...)"',
+            'junk',
+            '192.168.0.2 - - [18/Feb/2012:10:25:58 -0500] '
+            '"GET / HTTP/1.1" 404 - "-" "Mozilla/5.0 (...)"',
+            '192.168.0.1 - - [18/Feb/2012:10:26:00 -0500] '
+            '"POST /form HTTP/1.1" 200 20 "-" "Mozilla/5.0 (...)"',
+            ]
+        self.p = Parser(FORMATS['extended'])
+
+    def testbatches(self):
+        batches = list(self.p.parse_columns(
+                self.lines, batch_size=2, errors='skip'))
+        self.assertEqual([len(b) for b in batches], [2, 1])
+        self.assertEqual(list(batches[0]['%>s']), [200, 404])
+        self.assertEqual(list(batches[0]['%b']), [561, 0])
+        self.assertEqual(batches[0]['%t'][0], 1329578743)
+        self.assertEqual(list(batches[0]['%h']),
+                         ['192.168.0.1', '192.168.0.2'])
+        self.assertEqual(batches[1]['%r'].values, ['POST /form HTTP/1.1'])
+
+    def testrecords(self):
+        p = Parser(FORMATS['extended'], converters=True)
+        batch = next(self.p.parse_columns(self.lines, errors='skip'))
+        self.assertEqual(list(batch.records()),
+                         p.parse_many(self.lines, errors='skip'))
+
+    def testprojection(self):
+        p = Parser(FORMATS['extended'], fields=['%h', '%b'])
+        batch = next(p.parse_columns(self.lines, errors='skip'))
+        self.assertEqual(batch.names(), ['%h', '%b'])
+        self.assertEqual(batch['%h'].values, ['192.168.0.1', '192.168.0.2'])
+        self.assertEqual(list(batch['%h'].codes), [0, 1, 0])
+
+    def testraise(self):
+        batches = self.p.parse_columns(self.lines)
+        self.assertRaises(ApacheLogParserError, next, batches)
+
 
 if __name__ is '__main__':
     unittest.main()